@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd.
+"""Compare the classifier backends on the same representations
+
+Fits every backend on a train split of the representation store that
+train_util.py generates and reports the fit time, the latency of
+predict_proba on one face and on the whole test split, the accuracy on
+the test split and the pickled model size.
+"""
+import os
+import sys
+import time
+import pickle
+import argparse
+import logging
+import numpy as np
+from sklearn.model_selection import train_test_split
+from ros_face_recognition.rep_store import RepStore, migrate_csv
+from ros_face_recognition.classifiers import BACKENDS, fit_backend
+
+logger = logging.getLogger('hr.ros_face_recognition.bench_classifiers')
+
+def load_reps(classifier_dir):
+    store = RepStore(classifier_dir, 'reps')
+    migrate_csv(store, os.path.join(classifier_dir, 'reps.csv'),
+        os.path.join(classifier_dir, 'labels.csv'))
+    reps, labels = store.load()
+    return np.array(reps), np.asarray(labels)
+
+def run(backend, X_train, y_train, X_test, y_test, repeat):
+    start = time.time()
+    le, clf = fit_backend(backend, X_train, y_train)
+    fit_time = time.time() - start
+
+    start = time.time()
+    for i in range(repeat):
+        clf.predict_proba(X_test[i % len(X_test)][None, :])
+    single = (time.time() - start)/repeat
+
+    start = time.time()
+    prob = clf.predict_proba(X_test)
+    batch = time.time() - start
+
+    predicted = le.inverse_transform(np.argmax(prob, axis=1))
+    accuracy = np.mean(predicted == y_test)
+    size = len(pickle.dumps((le, clf), pickle.HIGHEST_PROTOCOL))
+    return fit_time, single, batch, accuracy, size
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--root-dir', default='lfw',
+        help='directory containing the classifier directory')
+    parser.add_argument('--backends', default=','.join(BACKENDS))
+    parser.add_argument('--test-size', type=float, default=0.25)
+    parser.add_argument('--repeat', type=int, default=200,
+        help='number of single face predictions to time')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    X, y = load_reps(os.path.join(args.root_dir, 'classifier'))
+    if len(y) == 0:
+        logger.error("No representations found in {}".format(args.root_dir))
+        sys.exit(1)
+    # Identities with a single sample cannot be split
+    names, counts = np.unique(y, return_counts=True)
+    keep = np.in1d(y, names[counts > 1])
+    X_train, X_test, y_train, y_test = train_test_split(X[keep], y[keep],
+        test_size=args.test_size, random_state=0, stratify=y[keep])
+    logger.info("{} identities, {} train and {} test samples".format(
+        len(np.unique(y_train)), len(y_train), len(y_test)))
+
+    print('{:>12} {:>9} {:>12} {:>12} {:>9} {:>9}'.format(
+        'backend', 'fit s', 'ms/face', 'ms/batch', 'accuracy', 'size KB'))
+    for backend in args.backends.split(','):
+        fit_time, single, batch, accuracy, size = run(backend,
+            X_train, y_train, X_test, y_test, args.repeat)
+        print('{:>12} {:>9.2f} {:>12.3f} {:>12.2f} {:>9.4f} {:>9.1f}'.format(
+            backend, fit_time, single*1000, batch*1000, accuracy, size/1024.0))
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd.
+"""Measure face detection time per frame for several detection scales
+
+The frames of a directory are treated as a sequence, so --roi-search
+measures the search around the faces found in the previous frame.
+"""
+import os
+import sys
+import time
+import argparse
+import logging
+import cv2
+from ros_face_recognition.detection import FaceDetector
+
+logger = logging.getLogger('hr.ros_face_recognition.bench_detection')
+
+def load_frames(image_dir, width=None):
+    frames = []
+    for fname in sorted(os.listdir(image_dir)):
+        img = cv2.imread(os.path.join(image_dir, fname))
+        if img is None:
+            continue
+        if width and img.shape[1] != width:
+            f = float(width)/img.shape[1]
+            img = cv2.resize(img, None, fx=f, fy=f)
+        frames.append(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+    return frames
+
+def run(frames, scale, upsample, roi_search):
+    detector = FaceDetector(scale=scale, upsample=upsample, roi_search=roi_search)
+    priors = []
+    n_faces = 0
+    start = time.time()
+    for frame in frames:
+        priors = detector.detect(frame, priors)
+        n_faces += len(priors)
+    elapsed = time.time() - start
+    return elapsed/len(frames), n_faces
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('image_dir')
+    parser.add_argument('--width', type=int, action='append',
+        help='resize frames to this width, can be repeated')
+    parser.add_argument('--scales', default='1.0,0.75,0.5,0.25')
+    parser.add_argument('--upsample', type=int, default=1)
+    parser.add_argument('--roi-search', action='store_true')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    scales = [float(s) for s in args.scales.split(',')]
+    print('{:>6} {:>6} {:>10} {:>8} {:>6}'.format(
+        'width', 'scale', 'ms/frame', 'speedup', 'faces'))
+    for width in args.width or [None]:
+        frames = load_frames(args.image_dir, width)
+        if not frames:
+            logger.error("No images found in {}".format(args.image_dir))
+            sys.exit(1)
+        base = None
+        for scale in scales:
+            t, n_faces = run(frames, scale, args.upsample, args.roi_search)
+            base = base or t
+            print('{:>6} {:>6.2f} {:>10.1f} {:>8.2f} {:>6}'.format(
+                frames[0].shape[1], scale, t*1000, base/t, n_faces))
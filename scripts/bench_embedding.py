@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd.
+"""Compare the embedding backends on the same aligned faces
+
+Embeds the aligned images of a directory with every backend and checks
+that the representations match those of the first backend, the Torch
+subprocess by default, within a squared distance tolerance. Reports the
+throughput of every backend at each batch size. Exits with 1 when a
+backend is not equivalent.
+"""
+import os
+import sys
+import time
+import argparse
+import logging
+import numpy as np
+from openface.data import iterImgs
+from ros_face_recognition.embedding import EMBEDDERS, create_embedder
+
+HR_MODELS = os.environ.get('HR_MODELS', os.path.expanduser('~/.hr/cache/models'))
+NETWORK_MODEL = os.path.join(HR_MODELS, 'nn4.small2.v1.t7')
+
+logger = logging.getLogger('hr.ros_face_recognition.bench_embedding')
+
+def load_faces(aligned_dir, limit):
+    images = sorted(iterImgs(aligned_dir), key=lambda img: img.path)
+    if limit:
+        images = images[:limit]
+    return np.stack([img.getRGB() for img in images]) if images else None
+
+def embed(net, faces, batch_size):
+    """Representations of the faces and the seconds it took"""
+    reps = np.empty((len(faces), 128), dtype=np.float32)
+    start = time.time()
+    for i in range(0, len(faces), batch_size):
+        reps[i:i+batch_size] = net.forward_batch(faces[i:i+batch_size])
+    return reps, time.time() - start
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--aligned-dir', default='lfw/aligned-images')
+    parser.add_argument('--network-model', default=NETWORK_MODEL)
+    parser.add_argument('--backends', default='torch,opencv',
+        help='backends to compare, the first is the reference')
+    parser.add_argument('--batch-sizes', default='1,16,64')
+    parser.add_argument('--limit', type=int, default=500,
+        help='maximum number of faces')
+    parser.add_argument('--tolerance', type=float, default=1e-4,
+        help='allowed squared distance to the reference representation')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    faces = load_faces(args.aligned_dir, args.limit)
+    if faces is None:
+        logger.error("No aligned faces found in {}".format(args.aligned_dir))
+        sys.exit(1)
+    backends = args.backends.split(',')
+    for backend in backends:
+        if backend not in EMBEDDERS:
+            logger.error("Unknown embedding backend {}".format(backend))
+            sys.exit(1)
+    batch_sizes = [int(v) for v in args.batch_sizes.split(',')]
+    logger.info("{} faces from {}".format(len(faces), args.aligned_dir))
+
+    print('{:>8} {:>6} {:>10} {:>10} {:>12} {:>12}'.format(
+        'backend', 'batch', 'faces/s', 'ms/face', 'max dist', 'min cosine'))
+    reference = None
+    equivalent = True
+    for backend in backends:
+        start = time.time()
+        net = create_embedder(backend, args.network_model, faces.shape[1])
+        logger.info("Loaded {} in {:.2f}s".format(net.name, time.time() - start))
+        if net.name != backend:
+            logger.error("Backend {} is not available".format(backend))
+            equivalent = False
+            continue
+        for batch_size in batch_sizes:
+            reps, seconds = embed(net, faces, batch_size)
+            if reference is None:
+                reference = reps
+            dist = np.sum((reps - reference)**2, axis=1)
+            cosine = np.sum(reps*reference, axis=1)/(
+                np.linalg.norm(reps, axis=1)*np.linalg.norm(reference, axis=1))
+            if dist.max() > args.tolerance:
+                equivalent = False
+            print('{:>8} {:>6} {:>10.1f} {:>10.3f} {:>12.2e} {:>12.6f}'.format(
+                backend, batch_size, len(faces)/seconds, seconds*1000/len(faces),
+                dist.max(), cosine.min()))
+    if not equivalent:
+        logger.error("Representations differ by more than {}".format(args.tolerance))
+        sys.exit(1)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd.
+"""Replay frames through FaceRecognizer without a ROS master
+
+Frames come from a directory of images or from an image topic of a bag
+file. Every combination of the given configurations is run in its own
+process, so the peak RSS is measured per configuration, and one JSON
+object per configuration is written with the throughput, end-to-end
+latency percentiles, peak RSS, per-stage breakdown and counters, e.g.
+of the frame decodes, copies and buffer allocations. With --compressed
+the images of a directory are replayed as JPEG CompressedImage messages.
+
+With --standins the dlib and Torch models are replaced by deterministic
+stand-ins, so the benchmark runs on any Linux box without model files.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+import logging
+import resource
+import multiprocessing
+import numpy as np
+import cv2
+
+logger = logging.getLogger('hr.ros_face_recognition.benchmark')
+
+def load_frames(source, topic, limit, compressed=False):
+    from cv_bridge import CvBridge
+    bridge = CvBridge()
+    frames = []
+    if os.path.isdir(source):
+        for fname in sorted(os.listdir(source)):
+            img = cv2.imread(os.path.join(source, fname))
+            if img is not None and compressed:
+                frames.append(bridge.cv2_to_compressed_imgmsg(img, 'jpg'))
+            elif img is not None:
+                frames.append(bridge.cv2_to_imgmsg(img, 'bgr8'))
+            if limit and len(frames) >= limit:
+                break
+    else:
+        import rosbag
+        with rosbag.Bag(source) as bag:
+            for _, msg, _ in bag.read_messages(topics=[topic]):
+                frames.append(msg)
+                if limit and len(frames) >= limit:
+                    break
+    return frames
+
+def enroll(recognizer, frames, n_identities):
+    """Enroll the faces of the first frames as synthetic identities, so
+    the classifier and gallery backends have something to match. The
+    classifier is fitted with the configured classifier backend."""
+    from ros_face_recognition.classifiers import fit_backend
+    from ros_face_recognition.gallery import GalleryIndex
+    reps, labels = [], []
+    for i, frame in enumerate(frames):
+        r, _, _ = recognizer.getRep(frame, True)
+        for rep in r:
+            reps.append(rep)
+            labels.append('person{}'.format(len(labels) % n_identities))
+    if len(set(labels)) < 2:
+        raise RuntimeError("Not enough faces found to enroll identities")
+    reps = np.array(reps)
+    recognizer.model = fit_backend(recognizer.classifier_backend, reps, labels)
+    recognizer.known_names = set(labels)
+    recognizer.gallery = GalleryIndex(reps, labels)
+
+def run_config(args, config, queue):
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from face_recognizer import FaceRecognizer
+    from dynamic_reconfigure.encoding import Config
+    from ros_face_recognition.cfg import FaceRecognitionConfig
+    from ros_face_recognition.profiling import StageProfiler
+    from ros_face_recognition.standins import StandInModels
+
+    models = StandInModels() if args.standins else None
+    recognizer = FaceRecognizer(models=models, params={})
+    recognizer.recognition_interval = args.recognize_every
+    for pub in [recognizer.camera.imgpub, recognizer.camera.compressed_imgpub]:
+        pub.subscribers = int(args.debug_image)
+    cfg = Config(FaceRecognitionConfig.defaults)
+    cfg.update(config)
+    recognizer.reconfig(cfg, 0)
+
+    frames = load_frames(args.source, args.topic, args.limit, args.compressed)
+    if not frames:
+        queue.put({'error': 'no frames in {}'.format(args.source)})
+        return
+    enroll(recognizer, frames[:args.enroll_frames], args.identities)
+    recognizer.profiler = StageProfiler(window=max(1024, len(frames)*args.repeat))
+
+    latencies = []
+    start = time.time()
+    for _ in range(args.repeat):
+        for frame in frames:
+            t = time.time()
+            recognizer.process_frame(frame)
+            latencies.append(time.time() - t)
+    elapsed = time.time() - start
+
+    latencies = np.array(latencies)*1000
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    queue.put({
+        'config': config,
+        'standins': args.standins,
+        'frames': len(latencies),
+        'seconds': elapsed,
+        'fps': len(latencies)/elapsed,
+        'latency_ms': {'p50': p50, 'p95': p95, 'p99': p99,
+                       'max': float(latencies.max())},
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.0,
+        'stages': recognizer.profiler.summary()['stages'],
+        'counters': recognizer.profiler.summary()['counters'],
+    })
+
+def configs(args):
+    axes = [
+        ('multi_faces', [bool(int(v)) for v in args.multi_faces.split(',')]),
+        ('detect_scale', [float(v) for v in args.detect_scale.split(',')]),
+        ('recognition_backend', args.backend.split(',')),
+        ('classifier_backend', args.classifier_backend.split(',')),
+    ]
+    names = [name for name, _ in axes]
+    for values in itertools.product(*[v for _, v in axes]):
+        yield dict(zip(names, values))
+
+def check_regressions(results, baseline_fname, tolerance):
+    key = lambda r: json.dumps(r['config'], sort_keys=True)
+    with open(baseline_fname) as f:
+        baseline = dict((key(r), r) for r in map(json.loads, f) if 'config' in r)
+    failed = False
+    for result in results:
+        base = baseline.get(key(result))
+        if base is None:
+            continue
+        if result['fps'] < base['fps']*(1 - tolerance):
+            logger.error("Throughput regression {}: {:.1f} fps, baseline {:.1f} fps".format(
+                key(result), result['fps'], base['fps']))
+            failed = True
+    return not failed
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('source', help='image directory or bag file')
+    parser.add_argument('--topic', default='/camera/image_raw')
+    parser.add_argument('--limit', type=int, default=0, help='maximum number of frames')
+    parser.add_argument('--compressed', action='store_true',
+        help='replay the images of a directory as CompressedImage messages')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--standins', action='store_true',
+        help='use deterministic stand-ins for the dlib and Torch models')
+    parser.add_argument('--recognize-every', type=int, default=1,
+        help='recognize every n-th frame, the node uses 30')
+    parser.add_argument('--debug-image', action='store_true',
+        help='include the debug image in the measurement')
+    parser.add_argument('--enroll-frames', type=int, default=10)
+    parser.add_argument('--identities', type=int, default=3)
+    parser.add_argument('--multi-faces', default='0,1')
+    parser.add_argument('--detect-scale', default='1.0,0.5')
+    parser.add_argument('--backend', default='classifier,gallery')
+    parser.add_argument('--classifier-backend', default='svc',
+        help='classifier backends to fit, any of svc,linear,ncm,incremental')
+    parser.add_argument('--output', help='write JSON lines to this file')
+    parser.add_argument('--baseline', help='JSON lines of a previous run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+        help='allowed relative throughput drop against the baseline')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARN)
+
+    results = []
+    out = open(args.output, 'w') if args.output else sys.stdout
+    for config in configs(args):
+        queue = multiprocessing.Queue()
+        job = multiprocessing.Process(target=run_config, args=(args, config, queue))
+        job.start()
+        result = queue.get()
+        job.join()
+        if 'error' in result:
+            logger.error(result['error'])
+            sys.exit(1)
+        results.append(result)
+        out.write(json.dumps(result, sort_keys=True) + '\n')
+        out.flush()
+    if args.baseline and not check_regressions(results, args.baseline, args.tolerance):
+        sys.exit(1)
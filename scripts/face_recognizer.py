@@ -15,35 +15,50 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import time
+START_TIME = time.time()
+
 import os
 import cv2
-import pickle
-import random
 import uuid
 import datetime as dt
-import time
 import numpy as np
-import pandas as pd
 import logging
 import threading
 import shutil
 import tempfile
-from collections import deque
+import copy
+import json
+from collections import OrderedDict
 
-from sklearn.preprocessing import LabelEncoder
-from sklearn.svm import SVC
-import dlib
 import openface
 from openface.data import iterImgs
 import rospy
 from cv_bridge import CvBridge
-from sensor_msgs.msg import Image
+from sensor_msgs.msg import Image, CompressedImage
 from dynamic_reconfigure.server import Server
 import dynamic_reconfigure.client
 from ros_face_recognition.cfg import FaceRecognitionConfig
 from ros_face_recognition.utils import get_3d_point
-from ros_face_recognition.msg import Face, Faces
-from std_msgs.msg import String
+from ros_face_recognition.pipeline import FramePipeline
+from ros_face_recognition.frames import Frame, BufferPool
+from ros_face_recognition.alignment import AlignmentEngine
+from ros_face_recognition.embedding_cache import EmbeddingCache
+from ros_face_recognition.rep_store import RepStore, migrate_csv, load_stores
+from ros_face_recognition.classifiers import (IncrementalOVR, label_encoder,
+    fit_backend, save_model, load_model)
+from ros_face_recognition.gallery import GalleryIndex
+from ros_face_recognition.camera import CameraContext, camera_name
+from ros_face_recognition.snapshots import SnapshotStore
+from ros_face_recognition.sample_gate import SampleGate
+from ros_face_recognition.msg import Face, Faces, PersonState
+from ros_face_recognition.param_sync import ParamSync
+from ros_face_recognition.profiling import StageProfiler
+from ros_face_recognition.standins import NullPublisher
+from ros_face_recognition.models import Models
+from ros_face_recognition.embedding_pool import EmbeddingPool, LIVE, BULK
+from std_msgs.msg import String, Bool
+from diagnostic_msgs.msg import DiagnosticArray, DiagnosticStatus, KeyValue
 
 CWD = os.path.dirname(os.path.abspath(__file__))
 HR_MODELS = os.environ.get('HR_MODELS', os.path.expanduser('~/.hr/models'))
@@ -56,6 +71,11 @@ DLIB_FACEPREDICTOR = os.path.join(HR_MODELS,
 NETWORK_MODEL = os.path.join(HR_MODELS, 'nn4.small2.v1.t7')
 logger = logging.getLogger('hr.vision.ros_face_recognition.face_recognizer')
 
+# Left out of snapshots: the snapshots themselves and samples being deleted
+SNAPSHOT_EXCLUDE = ('archive', '.trash-*')
+# Aligned faces embedded per forward pass when training
+EMBED_BATCH_SIZE = 64
+
 for d in [DATA_DIR, DATA_ARCHIVE_DIR, CLASSIFIER_DIR]:
     if not os.path.isdir(d):
         os.makedirs(d)
@@ -69,163 +89,460 @@ class FaceRecognizer(object):
             self.bbox = bbox
             self.landmarks = landmarks
 
-    def __init__(self):
+    def __init__(self, models=None, params=None):
+        """models replaces the dlib and Torch models, e.g. with
+        ros_face_recognition.standins.StandInModels. With params the node
+        runs without a ROS master, parameters are looked up in the dict
+        and nothing is published."""
+        self.offline = params is not None
+        self.params = params or {}
+        self.profiler = StageProfiler()
         self.bridge = CvBridge()
+        self.frame_pool = BufferPool()
         self.imgDim = 96
-        self.align = openface.AlignDlib(DLIB_FACEPREDICTOR)
-        self.face_pose_predictor = dlib.shape_predictor(DLIB_FACEPREDICTOR)
-        self.net = openface.TorchNeuralNet(NETWORK_MODEL, self.imgDim)
+        embedding_backend = self.get_param('~embedding_backend', 'opencv')
+        self.models = models or Models(DLIB_FACEPREDICTOR, NETWORK_MODEL,
+            self.imgDim, embedding_backend)
+        # With embed_workers, live recognition and training share worker
+        # processes, live first. Without, the network runs in process.
+        self.embedding_pool = None
+        embed_workers = self.get_param('~embed_workers', 0)
+        if models is None and embed_workers > 0:
+            self.embedding_pool = EmbeddingPool(embedding_backend, NETWORK_MODEL,
+                self.imgDim, embed_workers,
+                self.get_param('~embed_reserved_workers', 0),
+                self.get_param('~embed_bulk_chunk', 16))
         self.landmarkIndices = openface.AlignDlib.OUTER_EYES_AND_NOSE
-        self.face_detector = dlib.get_frontal_face_detector()
-        self.count = 0
+        self.recognition_interval = 30 # Recognize every n-th frame
         self.face_count = 0 # Cumulative total faces in training.
         self.max_face_count = 10
         self.train = False
+        self.incremental = False
+        self.classifier_backend = 'svc'
+        self.sample_gate = SampleGate()
+        self.gate_samples = True
+        self.crop_samples = False
+        self.crop_padding = 0.5
         self.enable = True
         self.train_dir = os.path.join(DATA_DIR, 'training-images')
         self.aligned_dir = os.path.join(DATA_DIR, 'aligned-images')
-        self.clf, self.le = None, None
-        self.known_names = rospy.get_param('known_names', [])
+        self.model = (None, None) # (le, clf), only ever replaced as a whole
+        # Training aligns alongside recognition, so the engine loads its
+        # own predictor instead of sharing the live one
+        self.align_engine = AlignmentEngine(DLIB_FACEPREDICTOR, self.imgDim,
+            self.landmarkIndices, self.get_param('~align_workers', 1))
+        self.embedding_cache = EmbeddingCache(
+            os.path.join(CLASSIFIER_DIR, 'embeddings.pkl'), NETWORK_MODEL,
+            embedding_backend)
+        self.known_names = set(self.get_param('known_names', []))
         classifier = os.path.join(CLASSIFIER_DIR, 'classifier.pkl')
         if os.path.isfile(classifier):
-            self.load_classifier(classifier)
-            label_fname = "{}/local_labels.csv".format(CLASSIFIER_DIR)
-            if os.path.isfile(label_fname):
-                df = pd.read_csv(label_fname, header=None)
-                if not df.empty:
-                    for name in set(df[0].tolist()):
-                        self.known_names.append(name)
+            store = self.local_store()
+            migrate_csv(store, "{}/local_reps.csv".format(CLASSIFIER_DIR),
+                "{}/local_labels.csv".format(CLASSIFIER_DIR))
+            self.known_names.update(store.classes)
         else:
-            self.load_classifier(os.path.join(DEFAULT_CLASSIFIER_DIR, 'classifier.pkl'))
-        self.node_name = rospy.get_name()
+            classifier = os.path.join(DEFAULT_CLASSIFIER_DIR, 'classifier.pkl')
+        self.classifier_file = classifier
+        self.node_name = 'face_recognizer' if self.offline else rospy.get_name()
         self.multi_faces = False
         self.threshold = 0.5
-        self.detected_faces = deque(maxlen=10)
+        self.recognition_backend = 'classifier'
+        self.gallery_threshold = 0.8
+        self.gallery_approximate = False
+        self.gallery = None
+        self.tracking = False
+        self.adaptive_schedule = False
         self.training_job = None
         self.stop_training = threading.Event()
-        self.faces = []
-        self.event_pub = rospy.Publisher(
+        self.snapshots = SnapshotStore(DATA_ARCHIVE_DIR,
+            self.get_param('~snapshot_keep', 10))
+        self.snapshot_job = None
+        self._snapshot_again = False
+        self._snapshot_lock = threading.Lock()
+        self.event_pub = self.publisher(
             'face_training_event', String, latch=True, queue_size=1)
-        self.faces_pub = rospy.Publisher(
-            '~faces', Faces, latch=True, queue_size=1)
-        self.imgpub = rospy.Publisher(
-            '~image', Image, latch=True, queue_size=1)
+        self.debug_image_rate = 0
+        self.debug_image_scale = 1.0
+        self.debug_jpeg_quality = 80
+        # With several cameras their topics and parameters are prefixed
+        # with the camera name. Samples are only collected from the first.
+        topics = self.get_param('~camera_topics', ['/camera/image_raw'])
+        self.cameras = OrderedDict()
+        for topic in topics:
+            name = camera_name(topic)
+            self.cameras[name] = self.create_camera(name, topic,
+                '{}/'.format(name) if len(topics) > 1 else '')
+        self.camera = next(iter(self.cameras.values()))
+        self.param_sync = ParamSync(self.node_name, set_param=
+            (lambda key, value: None) if self.offline else rospy.set_param)
+        self.diagnostics_pub = self.publisher(
+            '/diagnostics', DiagnosticArray, queue_size=1)
+        self.ready_pub = self.publisher(
+            '~ready', Bool, latch=True, queue_size=1)
+        self.ready = threading.Event()
+        self.startup_time = None
+        self.first_recognition_time = None
         self._lock = threading.RLock()
+        self._train_lock = threading.RLock()
+        # The in-process network is not safe to call from several threads
+        self._net_lock = threading.Lock()
+        self._predictor_lock = threading.Lock()
+        self.pipeline = None
+        workers = self.get_param('~pipeline_workers', 0)
+        if workers > 0:
+            self.pipeline = FramePipeline(self.process_frame, workers,
+                self.get_param('~pipeline_report_interval', 10),
+                list(self.cameras.values()))
+            self.pipeline.start()
+        if self.offline:
+            self.warm_up()
+        else:
+            job = threading.Thread(target=self.warm_up, name='warm-up')
+            job.daemon = True
+            job.start()
+        period = self.get_param('~diagnostics_period', 5.0)
+        if period > 0 and not self.offline:
+            self.diagnostics_timer = rospy.Timer(
+                rospy.Duration(period), self.publish_diagnostics)
         self.colors = [ (255, 0, 0), (0, 255, 0), (0, 0, 255),
             (255, 255, 0), (255, 0, 255), (0, 255, 255) ]
 
+    def create_camera(self, name, topic, prefix):
+        # dlib detectors are not shared between threads, every camera of the
+        # real models gets its own
+        detector = None if isinstance(self.models, Models) else self.align.detector
+        cam = CameraContext(name, topic, detector, prefix)
+        cam.faces_pub = self.publisher(
+            '~{}faces'.format(prefix), Faces, latch=True, queue_size=1)
+        cam.imgpub = self.publisher(
+            '~{}image'.format(prefix), Image, latch=True, queue_size=1)
+        cam.compressed_imgpub = self.publisher(
+            '~{}image/compressed'.format(prefix), CompressedImage,
+            latch=True, queue_size=1)
+        cam.schedule_pub = self.publisher(
+            '~{}schedule'.format(prefix), String, queue_size=10)
+        cam.state_pub = self.publisher(
+            '~{}state'.format(prefix), PersonState, latch=True, queue_size=1)
+        return cam
+
+    @property
+    def align(self):
+        # The models load on first use, in the warm up thread
+        return self.models.align
+
+    @property
+    def face_pose_predictor(self):
+        return self.models.face_pose_predictor
+
+    @property
+    def net(self):
+        if self.embedding_pool is not None and not self.embedding_pool.closed:
+            return self.embedding_pool
+        return self.models.net
+
+    @property
+    def le(self):
+        return self.model[0]
+
+    @property
+    def clf(self):
+        return self.model[1]
+
+    def warm_up(self):
+        """Load the classifier and the network and run a dummy face
+        through them, so the first recognition does not pay for it. The
+        node is shut down if that fails, instead of dropping every frame
+        as not ready."""
+        try:
+            self._warm_up()
+        except Exception as ex:
+            logger.error("Warming up failed")
+            logger.error(ex)
+            if self.offline:
+                raise
+            rospy.signal_shutdown('warming up failed: {}'.format(ex))
+
+    def _warm_up(self):
+        with self.profiler.stage('startup.load'):
+            with self._lock:
+                if self.clf is None:
+                    self.load_classifier(self.classifier_file)
+            self.align
+            if self.embedding_pool is not None:
+                self.embedding_pool.start()
+            else:
+                self.net
+        with self.profiler.stage('startup.warmup'):
+            dummy = np.zeros((self.imgDim, self.imgDim, 3), dtype=np.uint8)
+            self.align.getAllFaceBoundingBoxes(dummy)
+            reps = self.forward_batch([dummy])
+            if self.clf is not None:
+                self.clf.predict_proba(reps)
+        self.startup_time = time.time() - START_TIME
+        logger.warn("Ready {:.2f}s after start".format(self.startup_time))
+        self.ready.set()
+        self.ready_pub.publish(True)
+
+    def recognized(self):
+        if self.first_recognition_time is None:
+            self.first_recognition_time = time.time() - START_TIME
+            logger.warn("First recognition {:.2f}s after start".format(
+                self.first_recognition_time))
+
+    def get_param(self, name, default):
+        if self.offline:
+            return self.params.get(name, default)
+        return rospy.get_param(name, default)
+
+    def publisher(self, topic, msg_class, **kwargs):
+        if self.offline:
+            return NullPublisher()
+        return rospy.Publisher(topic, msg_class, **kwargs)
+
+    def now(self):
+        if self.offline:
+            return rospy.Time.from_sec(time.time())
+        return rospy.Time.now()
+
     def load_classifier(self, model):
         if os.path.isfile(model):
-            with open(model) as f:
-                try:
-                    self.le, self.clf = pickle.load(f)
-                    logger.info("Loaded model {}".format(model))
-                except Exception as ex:
-                    logger.error("Loading model {} failed".format(model))
-                    logger.error(ex)
-                    self.clf, self.le = None, None
+            try:
+                le, clf, backend = load_model(model)
+                self.model = (le, clf)
+                logger.info("Loaded {} model {}".format(backend, model))
+            except Exception as ex:
+                logger.error("Loading model {} failed".format(model))
+                logger.error(ex)
+                self.model = (None, None)
         else:
             logger.error("Model file {} is not found".format(model))
 
-    def getRep(self, bgrImg, all=True):
-        if bgrImg is None:
-            return [], []
+    def local_store(self):
+        return RepStore(CLASSIFIER_DIR, 'local')
 
-        rgbImg = cv2.cvtColor(bgrImg, cv2.COLOR_BGR2RGB)
-        if all:
-            bb = self.align.getAllFaceBoundingBoxes(rgbImg)
-        else:
-            bb = self.align.getLargestFaceBoundingBox(rgbImg)
+    def default_store(self):
+        store = RepStore(DEFAULT_CLASSIFIER_DIR, 'reps')
+        if store.exists():
+            return store
+        # Convert the csv files shipped with the default model once
+        store = RepStore(CLASSIFIER_DIR, 'default')
+        migrate_csv(store, "{}/reps.csv".format(DEFAULT_CLASSIFIER_DIR),
+            "{}/labels.csv".format(DEFAULT_CLASSIFIER_DIR))
+        return store
 
-        if bb is None:
-            return [], []
+    def to_frame(self, image):
+        """Wrap an Image or CompressedImage message or a BGR image"""
+        if isinstance(image, Frame):
+            return image
+        if isinstance(image, np.ndarray):
+            return Frame(image=image, pool=self.frame_pool, profiler=self.profiler)
+        return Frame(image, pool=self.frame_pool, bridge=self.bridge,
+            profiler=self.profiler)
 
-        if not hasattr(bb, '__iter__'):
-            bb = [bb]
+    def detect_faces(self, rgbImg, all=True, priors=None, cam=None):
+        """Detect the faces in an RGB image or a Frame. A compressed frame
+        is decoded at the detection scale when that is enough."""
+        cam = cam or self.camera
+        reduced = None
+        if isinstance(rgbImg, Frame):
+            frame = rgbImg
+            reduced = frame.reduced(cam.face_detector.scale, rgb=True)
+            rgbImg = lambda: frame.rgb
+        with self.profiler.stage('detect'):
+            if priors is None:
+                priors = [f.bbox for f in cam.faces]
+            if all:
+                return cam.face_detector.detect(rgbImg, priors, reduced)
+            bb = cam.face_detector.largest(rgbImg, priors, reduced)
+            if bb is None:
+                return []
+            return [bb]
 
-        reps = []
-        for box in bb:
-            aligned_face = self.align.align(self.imgDim, rgbImg, box,
-                    landmarkIndices=self.landmarkIndices)
-            reps.append(self.net.forward(aligned_face))
+    def landmarks(self, rgbImg, box):
+        """The 68 (x, y) landmarks of the face in the box"""
+        with self.profiler.stage('landmarks'), self._predictor_lock:
+            shape = self.face_pose_predictor(rgbImg, box)
+            return [(p.x, p.y) for p in shape.parts()]
 
-        return reps, bb
+    def embed_faces(self, rgbImg, bb):
+        """Align and embed the faces in the boxes. Boxes that could not
+        be aligned are left out of the returned boxes. The landmarks the
+        faces were aligned with are returned with them."""
+        faces, boxes, landmarks = [], [], []
+        with self.profiler.stage('align'):
+            for box in bb:
+                points = self.landmarks(rgbImg, box)
+                aligned_face = self.align.align(self.imgDim, rgbImg, box,
+                        landmarks=points, landmarkIndices=self.landmarkIndices)
+                if aligned_face is not None:
+                    faces.append(aligned_face)
+                    boxes.append(box)
+                    landmarks.append(points)
+        if not faces:
+            return [], [], []
 
-    def align_image(self, imgObject, imgName):
-        rgb = imgObject.getRGB()
-        if rgb is None:
-            outRgb = None
-        else:
-            outRgb = self.align.align(
-                    self.imgDim, rgb,
-                    landmarkIndices=self.landmarkIndices)
-        if outRgb is not None:
-            outBgr = cv2.cvtColor(outRgb, cv2.COLOR_RGB2BGR)
-            cv2.imwrite(imgName, outBgr)
-            logger.info("Write image {}".format(imgName))
-            return True
-        else:
-            os.remove(imgObject.path)
-            logger.warn("No face was detected in {}. Removed.".format(imgObject.path))
-            return False
+        with self.profiler.stage('forward'):
+            reps = self.forward_batch(np.stack(faces))
+        return reps, boxes, landmarks
+
+    def getRep(self, bgrImg, all=True, cam=None):
+        """Representations of the faces in a BGR image or a Frame"""
+        if bgrImg is None:
+            return [], [], []
+
+        frame = self.to_frame(bgrImg)
+        try:
+            bb = self.detect_faces(frame, all, cam=cam)
+            if not bb:
+                return [], [], []
+            return self.embed_faces(frame.rgb, bb)
+        finally:
+            if frame is not bgrImg:
+                frame.release()
+
+    def forward_batch(self, faces, priority=LIVE):
+        """Embed an NxHxWx3 batch of aligned RGB faces into an (N,128) matrix"""
+        pool = self.embedding_pool
+        if pool is not None and not pool.closed:
+            try:
+                return pool.forward_batch(faces, priority)
+            except RuntimeError:
+                if not pool.closed:
+                    raise
+                logger.error("No embedding worker is left, using the network in process")
+        net = self.models.net
+        with self._net_lock:
+            if hasattr(net, 'forward_batch'):
+                return net.forward_batch(faces)
+            return np.vstack([net.forward(face) for face in faces])
 
     def align_images(self, input_dir):
-        imgs = list(iterImgs(input_dir))
-        # Shuffle so multiple versions can be run at once.
-        random.shuffle(imgs)
-
-        for imgObject in imgs:
-            outDir = os.path.join(self.aligned_dir, imgObject.cls)
-            if not os.path.isdir(outDir):
-                os.makedirs(outDir)
-            outputPrefix = os.path.join(outDir, imgObject.name)
-            imgName = outputPrefix + ".png"
-            if not os.path.isfile(imgName):
-                logger.info("Aligning image %s", imgName)
-                try:
-                    self.align_image(imgObject, imgName)
-                except Exception as ex:
-                    logger.error(ex)
-            else:
-                logger.info("Skip existing aligned image %s", imgName)
+        self.align_engine.run(input_dir, self.aligned_dir,
+            should_stop=self.stop_training.is_set, resume=False,
+            progress=lambda i, n: self.training_progress('align', i, n))
 
     def gen_data(self):
+        """Embed the aligned images that are not in the local store yet and
+        append them. The store is only rewritten when some of its images
+        are gone."""
+        with self._lock:
+            store = self.local_store()
+            stored = set(zip(store.labels(), store.names()))
+        images = list(iterImgs(self.aligned_dir))
+        rewrite = bool(stored - set((img.cls, img.name) for img in images))
+        if not rewrite:
+            images = [img for img in images if (img.cls, img.name) not in stored]
         face_reps = []
         labels = []
-        reps_fname = "{}/reps.csv".format(CLASSIFIER_DIR)
-        label_fname = "{}/labels.csv".format(CLASSIFIER_DIR)
-        local_reps_fname = "{}/local_reps.csv".format(CLASSIFIER_DIR)
-        local_label_fname = "{}/local_labels.csv".format(CLASSIFIER_DIR)
-        for imgObject in iterImgs(self.aligned_dir):
-            reps = self.net.forward(imgObject.getRGB())
-            face_reps.append(reps)
-            labels.append((imgObject.cls, imgObject.name))
-        if face_reps and labels and not self.stop_training.is_set():
-            pd.DataFrame(face_reps).to_csv(reps_fname, header=False, index=False)
-            pd.DataFrame(labels).to_csv(label_fname, header=False, index=False)
-            pd.DataFrame(face_reps).to_csv(local_reps_fname, header=False, index=False)
-            pd.DataFrame(labels).to_csv(local_label_fname, header=False, index=False)
-            logger.info("Generated label file {}".format(label_fname))
-            logger.info("Generated representation file {}".format(reps_fname))
-
-    def collect_face(self, image, crop=False):
+        cache = self.embedding_cache
+        for first in range(0, len(images), EMBED_BATCH_SIZE):
+            if self.stop_training.is_set():
+                break
+            batch = images[first:first+EMBED_BATCH_SIZE]
+            entries = [cache.get(imgObject.path) for imgObject in batch]
+            missing = [i for i, (_, reps) in enumerate(entries) if reps is None]
+            if missing:
+                computed = self.forward_batch(
+                    np.stack([batch[i].getRGB() for i in missing]), BULK)
+                for i, reps in zip(missing, computed):
+                    cache.put(entries[i][0], reps)
+                    entries[i] = (entries[i][0], reps)
+            face_reps.extend(reps for _, reps in entries)
+            labels.extend((imgObject.cls, imgObject.name) for imgObject in batch)
+            self.training_progress('embed', first + len(batch), len(images))
+        if self.stop_training.is_set() or not (rewrite or labels):
+            return
+        # Only a full pass saw every image the cache should keep
+        if rewrite:
+            cache.prune()
+        cache.save()
+        with self._lock:
+            store = self.local_store()
+            if rewrite:
+                store.write(face_reps, labels)
+            else:
+                store.append(face_reps, labels)
+        logger.info("Stored {} representations in {}".format(
+            len(labels), store.meta_fname))
+
+    def enrolled_reps(self, name):
+        """Representations of the samples already stored for the name"""
+        with self._lock:
+            store = self.local_store()
+            if not store.exists():
+                return None
+            reps, labels = store.load()
+        return np.asarray(reps)[np.asarray(labels) == name]
+
+    def gate_sample(self, frame, face):
+        """Align and embed the face if it passes the sample gate. Returns
+        (aligned face, rep, None) or (None, None, reason)."""
+        gate = self.sample_gate
+        reason = gate.check_face(frame.bgr, face)
+        if reason is not None:
+            return None, None, reason
+        rgbImg = frame.rgb
+        points = self.landmarks(rgbImg, face)
+        reason = gate.check_pose(points)
+        if reason is not None:
+            return None, None, reason
+        with self.profiler.stage('align'):
+            aligned_face = self.align.align(self.imgDim, rgbImg, face,
+                    landmarks=points, landmarkIndices=self.landmarkIndices)
+        if aligned_face is None:
+            return None, None, 'unaligned'
+        with self.profiler.stage('forward'):
+            rep = self.forward_batch(aligned_face[None])[0]
+        reason = gate.check_novelty(rep)
+        if reason is not None:
+            return None, None, reason
+        return aligned_face, rep, None
+
+    def collect_face(self, cam, frame):
+        """Save the largest face as a training sample. With the sample gate
+        on, small, blurry, turned away and duplicate faces are skipped and
+        the aligned face and its representation are stored with the sample
+        so training does not compute them again."""
         img_dir = os.path.join(self.train_dir, self.face_name)
         if not os.path.isdir(img_dir):
             os.makedirs(img_dir)
-        detected_faces = self.face_detector(image)
-        if detected_faces:
-            face = max(detected_faces, key=lambda rect: rect.width() * rect.height())
-            self.faces = [FaceRecognizer.Face('sample',1,face,None)]
-            self.republish(image, self.faces)
-            if crop:
-                image = image[face.top():face.bottom(), face.left():face.right()]
-                if image.size == 0:
-                    return
-            fname = os.path.join(img_dir, "{}.jpg".format(uuid.uuid1().hex))
-            cv2.imwrite(fname, image)
-            logger.info("Write face image to {}".format(fname))
-            self.face_count += 1
-            self.event_pub.publish('{}/{}'.format(self.face_count, self.max_face_count))
+        image = frame.bgr
+        face = cam.face_detector.largest(image, [f.bbox for f in cam.faces])
+        if face is None:
+            return
+        cam.faces = [FaceRecognizer.Face('sample',1,face,None)]
+        self.republish(cam, frame, cam.faces)
+        aligned_face, rep = None, None
+        if self.gate_samples:
+            aligned_face, rep, reason = self.gate_sample(frame, face)
+            if reason is not None:
+                self.profiler.count('samples rejected {}'.format(reason))
+                logger.debug("Sample rejected: {}".format(reason))
+                return
+        sample = image
+        if self.crop_samples:
+            height, width = image.shape[:2]
+            pad_x = int(face.width()*self.crop_padding)
+            pad_y = int(face.height()*self.crop_padding)
+            sample = image[max(0, face.top()-pad_y):min(height, face.bottom()+pad_y),
+                           max(0, face.left()-pad_x):min(width, face.right()+pad_x)]
+            if sample.size == 0:
+                return
+        name = uuid.uuid1().hex
+        fname = os.path.join(img_dir, "{}.jpg".format(name))
+        cv2.imwrite(fname, sample)
+        logger.info("Write face image to {}".format(fname))
+        if aligned_face is not None:
+            aligned_dir = os.path.join(self.aligned_dir, self.face_name)
+            if not os.path.isdir(aligned_dir):
+                os.makedirs(aligned_dir)
+            aligned_fname = os.path.join(aligned_dir, "{}.png".format(name))
+            cv2.imwrite(aligned_fname, cv2.cvtColor(aligned_face, cv2.COLOR_RGB2BGR))
+            self.embedding_cache.put(self.embedding_cache.digest(aligned_fname), rep)
+            self.sample_gate.add(rep)
+        self.face_count += 1
+        self.event_pub.publish('{}/{}'.format(self.face_count, self.max_face_count))
 
     def prepare(self):
         """Align faces, generate representations and labels"""
@@ -233,209 +550,565 @@ class FaceRecognizer(object):
         self.align_images(self.train_dir)
         self.gen_data()
 
-    def train_model(self):
-        with self._lock:
+    def fit_classifier(self, embeddings_data, labels_data, full=None, name=None):
+        """Fit (le, clf) with the configured backend. Unless full is set,
+        an incremental model only refits the identity being enrolled.
+        Returns (le, clf, backend), clf is None if the training is stopped."""
+        # The incremental flag predates the backend choice, either selects it
+        incremental = self.incremental or self.classifier_backend == 'incremental'
+        if full is None:
+            full = not incremental
+        if name is None:
             name = self.face_name
+        if not full and isinstance(self.clf, IncrementalOVR):
+            logger.info("Update model with {}".format(name))
+            clf = copy.deepcopy(self.clf)
+            clf.update(embeddings_data, labels_data, [name])
+            return label_encoder(clf.classes_), clf, 'incremental'
+        backend = 'incremental' if incremental else self.classifier_backend
+        logger.info("Fit {} model".format(backend))
+        le, clf = fit_backend(backend, embeddings_data, labels_data,
+            should_stop=self.stop_training.is_set)
+        return le, clf, backend
+
+    def save_classifier(self, le, clf, backend=None):
+        classifier_fname = "{}/classifier.pkl".format(CLASSIFIER_DIR)
+        save_model(classifier_fname, le, clf, backend)
+        logger.info("Model saved to {}".format(classifier_fname))
+        self.model = (le, clf)
+
+    def training_progress(self, stage, done, total):
+        self.event_pub.publish('training {} {}/{}'.format(stage, done, total))
+
+    def start_training(self, full=None, enrolling=False, name=None):
+        """Train in the background. The node keeps recognizing with the
+        current model until the new one is swapped in. The name being
+        enrolled is face_name unless given."""
+        if self.training_job is not None:
+            logger.warn("Training is already running")
+            return False
+        self.stop_training.clear()
+        self.training_job = threading.Thread(target=self.run_training,
+            args=(full, enrolling, name), name='training')
+        self.training_job.daemon = True
+        self.training_job.start()
+        return True
+
+    def run_training(self, full, enrolling, name=None):
+        try:
+            self.train_model(full, name)
+        except Exception as ex:
+            logger.error("Train model failed")
+            logger.error(ex)
+            self.event_pub.publish('abort')
+        finally:
+            self.training_job = None
+            if enrolling:
+                self.train = False
+                self.face_count = 0
+                self.update_parameter({'train': False})
+                self.update_parameter({'face_name': ''})
+
+    def train_model(self, full=None, name=None):
+        """Align, embed and fit. self._lock is only held to read the
+        stores and to swap in the new model, so recognition goes on."""
+        with self._train_lock:
+            face_name = self.face_name if name is None else name
             logger.info("Training model")
             self.event_pub.publish('training')
             self.prepare()
-            label_fname = "{}/labels.csv".format(CLASSIFIER_DIR)
-            reps_fname = "{}/reps.csv".format(CLASSIFIER_DIR)
-            labels, embeddings = None, None
-            if os.path.isfile(label_fname) and \
-                        os.path.isfile(reps_fname):
-                labels = pd.read_csv(label_fname, header=None)
-                embeddings = pd.read_csv(reps_fname, header=None)
-
-            if labels is None or embeddings is None:
+            if self.stop_training.is_set():
+                logger.info("Training is interrupted")
+                self.event_pub.publish('abort')
+                return
+
+            with self._lock:
+                embeddings_data, labels_data = load_stores(
+                    [self.local_store(), self.default_store()])
+
+            if labels_data is None:
                 logger.error("No labels or representations are found")
                 self.event_pub.publish('abort')
                 return
 
-            # append the existing data
-            original_label_fname = "{}/labels.csv".format(DEFAULT_CLASSIFIER_DIR)
-            original_reps_fname = "{}/reps.csv".format(DEFAULT_CLASSIFIER_DIR)
-            if os.path.isfile(original_label_fname) and \
-                        os.path.isfile(original_reps_fname):
-                labels2 = pd.read_csv(original_label_fname, header=None)
-                embeddings2 = pd.read_csv(original_reps_fname, header=None)
-                labels = labels.append(labels2)
-                embeddings = embeddings.append(embeddings2)
-
-            labels_data = labels.as_matrix()[:,0].tolist()
-            embeddings_data = embeddings.as_matrix()
-
-            le = LabelEncoder().fit(labels_data)
-            labelsNum = le.transform(labels_data)
-            clf = SVC(C=1, kernel='linear', probability=True)
+            self.event_pub.publish('training fit')
+            start = time.time()
             try:
-                clf.fit(embeddings_data, labelsNum)
+                le, clf, backend = self.fit_classifier(embeddings_data,
+                    labels_data, full, face_name)
             except ValueError as ex:
                 logger.error(ex)
                 self.event_pub.publish('abort')
                 return
+            logger.info("Fitting model took {:.2f}s".format(time.time()-start))
 
-            if not self.stop_training.is_set():
-                labels.to_csv(label_fname, header=False, index=False)
-                embeddings.to_csv(reps_fname, header=False, index=False)
-                logger.info("Update label file {}".format(label_fname))
-                logger.info("Update representation file {}".format(reps_fname))
+            if clf is None or self.stop_training.is_set():
+                logger.info("Training is interrupted")
+                self.event_pub.publish('abort')
+                return
+            with self._lock:
+                self.save_classifier(le, clf, backend)
+                if face_name:
+                    self.known_names.add(face_name)
+                self.gallery = None
+            logger.info("Training model is finished")
+            self.event_pub.publish('end')
 
-                classifier_fname = "{}/classifier.pkl".format(CLASSIFIER_DIR)
-                with open(classifier_fname, 'w') as f:
-                    pickle.dump((le, clf), f)
-                logger.info("Model saved to {}".format(classifier_fname))
+    def forget(self, name):
+        """Remove the samples and the identity from the local model"""
+        with self._train_lock:
+            shutil.rmtree(os.path.join(self.train_dir, name), ignore_errors=True)
+            shutil.rmtree(os.path.join(self.aligned_dir, name), ignore_errors=True)
+            with self._lock:
+                store = self.local_store()
+                reps, labels = store.load()
+                keep = labels != name
+                if keep.all():
+                    logger.warn("{} is not enrolled".format(name))
+                    return
+                names = [n for n, k in zip(store.names(), keep) if k]
+                reps, labels = reps[keep], labels[keep]
+                store.write(reps, list(zip(labels, names)))
+                self.known_names.discard(name)
+                self.gallery = None
+                clf = self.clf
+                if isinstance(clf, IncrementalOVR):
+                    clf = copy.deepcopy(clf)
+                    clf.remove(name)
+                    self.save_classifier(label_encoder(clf.classes_), clf,
+                        'incremental')
+            logger.info("Removed {}".format(name))
+        if not isinstance(clf, IncrementalOVR) and \
+                not self.start_training(full=True, name=''):
+            logger.warn("Training is running, retrain to remove {} from the model".format(name))
 
-                self.load_classifier(classifier_fname)
-                self.known_names.append(self.face_name)
-                self.event_pub.publish('end')
-            else:
-                self.event_pub.publish('abort')
+    def build_gallery(self):
+        """Index the enrolled faces of the known names"""
+        with self._lock:
+            reps, labels = load_stores([self.local_store(), self.default_store()])
+            if labels is None:
+                # An empty gallery is kept too, so the stores are not
+                # loaded again for every frame
+                reps = np.empty((0, 128), dtype=np.float32)
+                labels = np.empty(0, dtype=object)
+            known = np.in1d(labels, list(self.known_names))
+            self.gallery = GalleryIndex(reps[known], labels[known],
+                approximate=self.gallery_approximate)
+            return self.gallery
 
-    def infer(self, img):
-        if self.clf is None or self.le is None:
-            return None, None, None
-        reps, bb = self.getRep(img, self.multi_faces)
+    def identify(self, reps):
+        """Return the name, None if unknown, and confidence of each representation"""
+        if self.recognition_backend == 'gallery':
+            gallery = self.gallery
+            if gallery is None:
+                gallery = self.build_gallery()
+            if len(gallery) == 0:
+                return [None]*len(reps), [0]*len(reps)
+            with self.profiler.stage('classify'):
+                labels, distances = gallery.match(reps, self.gallery_threshold)
+            for label, d in zip(labels, distances):
+                if label is None:
+                    logger.info("Unknown face, distance {:.3f}".format(d))
+            # Squared distance of unit vectors is in [0, 4]
+            return list(labels), list(1 - distances/4.0)
+        le, clf = self.model
+        with self.profiler.stage('classify'):
+            predictions = clf.predict_proba(reps)
+        maxI = np.argmax(predictions, axis=1)
+        labels = list(le.inverse_transform(maxI))
+        for i, label in enumerate(labels):
+            if label not in self.known_names:
+                logger.info("{} is not in known names".format(label))
+                labels[i] = None
+        return labels, list(predictions[np.arange(len(maxI)), maxI])
+
+    def infer(self, img, cam=None):
+        if self.recognition_backend != 'gallery' and \
+                (self.clf is None or self.le is None):
+            return None, None, None, None
+        reps, bb, points = self.getRep(img, self.multi_faces, cam)
         persons = []
         confidences = []
         bboxes = []
-        for rep, box in zip(reps, bb):
-            try:
-                rep = rep.reshape(1, -1)
-            except:
-                logger.info("No Face detected")
-                return None, None, None
-            predictions = self.clf.predict_proba(rep).ravel()
-            maxI = np.argmax(predictions)
-            label = self.le.inverse_transform(maxI)
-            if label not in self.known_names:
-                logger.info("{} is not in known names".format(label))
+        landmarks = []
+        if len(reps) == 0:
+            return persons, confidences, bboxes, landmarks
+        names, confs = self.identify(reps)
+        for label, confidence, box, l in zip(names, confs, bb, points):
+            if label is None:
                 continue
-            persons.append(self.le.inverse_transform(maxI))
-            confidences.append(predictions[maxI])
+            persons.append(label)
+            confidences.append(confidence)
             bboxes.append(box)
-        return persons, confidences, bboxes
+            landmarks.append(l)
+        return persons, confidences, bboxes, landmarks
 
-    def overlay_image(self, image, faces):
+    def overlay_image(self, image, faces, scale=1.0):
         i = 0
         for face in sorted(faces,
                 key=lambda x: x.bbox.width()*x.bbox.height(), reverse=True):
             b = face.bbox
             p = face.name
-            cv2.rectangle(image, (b.left(), b.top()), (b.right(), b.bottom()), self.colors[i], 2)
-            cv2.putText(image, p, (b.left(), b.top()-10), cv2.FONT_HERSHEY_SIMPLEX, 1, self.colors[i], 2)
-            landmarks = face.landmarks
-            if landmarks:
-                for j in range(landmarks.num_parts):
-                    point = landmarks.part(j)
-                    x = int(point.x)
-                    y = int(point.y)
-                    cv2.circle(image, (x,y), 1, self.colors[i], 1)
+            left, top = int(b.left()*scale), int(b.top()*scale)
+            right, bottom = int(b.right()*scale), int(b.bottom()*scale)
+            cv2.rectangle(image, (left, top), (right, bottom), self.colors[i], 2)
+            cv2.putText(image, p, (left, top-10), cv2.FONT_HERSHEY_SIMPLEX, scale, self.colors[i], 2)
+            if face.landmarks:
+                for x, y in face.landmarks:
+                    cv2.circle(image, (int(x*scale), int(y*scale)), 1, self.colors[i], 1)
             i += 1
             i = i%6
 
-    def republish(self, image, faces):
-        if isinstance(image, Image):
-            image = self.bridge.imgmsg_to_cv2(image, "bgr8")
-        self.overlay_image(image, faces)
-        self.imgpub.publish(self.bridge.cv2_to_imgmsg(image, 'bgr8'))
+    def republish(self, cam, image, faces):
+        with self.profiler.stage('republish'):
+            self._republish(cam, image, faces)
 
-    def image_cb(self, ros_image):
+    def _republish(self, cam, image, faces):
+        """Publish the frame with the face overlay if anyone subscribes,
+        at most debug_image_rate times per second"""
+        raw = cam.imgpub.get_num_connections() > 0
+        compressed = cam.compressed_imgpub.get_num_connections() > 0
+        if not raw and not compressed:
+            return
+        now = time.time()
+        if self.debug_image_rate > 0 and \
+                now - cam.last_debug_image < 1.0/self.debug_image_rate:
+            return
+        cam.last_debug_image = now
+        header = None
+        scale = self.debug_image_scale
+        image_scale = 1.0
+        if isinstance(image, Frame):
+            header = image.header
+            reduced = image.reduced(scale)
+            image, image_scale = reduced if reduced is not None else (image.bgr, 1.0)
+        self.profiler.count('frame buffers allocated')
+        if scale != image_scale:
+            image = cv2.resize(image, None, fx=scale/image_scale, fy=scale/image_scale,
+                interpolation=cv2.INTER_AREA)
+        else:
+            # Don't draw on a frame that is still used, e.g. a training sample
+            self.profiler.count('frame copies')
+            image = image.copy()
+        self.overlay_image(image, faces, scale)
+        if raw:
+            msg = self.bridge.cv2_to_imgmsg(image, 'bgr8')
+            if header is not None:
+                msg.header = header
+            cam.imgpub.publish(msg)
+        if compressed:
+            msg = CompressedImage()
+            if header is not None:
+                msg.header = header
+            msg.format = 'jpeg'
+            msg.data = cv2.imencode('.jpg', image,
+                [int(cv2.IMWRITE_JPEG_QUALITY), self.debug_jpeg_quality])[1].tobytes()
+            cam.compressed_imgpub.publish(msg)
+
+    def image_cb(self, ros_image, cam=None):
         if not self.enable:
             return
+        if not self.ready.is_set():
+            self.profiler.count('frames before ready')
+            return
+
+        cam = cam or self.camera
+        if self.pipeline is not None:
+            self.pipeline.put(ros_image, cam)
+        else:
+            self.process_frame(ros_image, cam)
+
+    def process_frame(self, ros_image, cam=None):
+        cam = cam or self.camera
+        start = time.time()
+        frame = self.to_frame(ros_image)
+        try:
+            # The tracks, schedule and faces of a camera follow its frames
+            # one at a time, also when the subscribers call in directly
+            with cam.lock:
+                self._process_frame(frame, cam)
+        finally:
+            frame.release()
+            elapsed = time.time() - start
+            self.profiler.record('frame', elapsed)
+            if cam.prefix:
+                self.profiler.record(cam.prefix + 'frame', elapsed)
 
-        self.count += 1
-        if self.count % 30 != 0:
-            self.republish(ros_image, self.faces)
+    def _process_frame(self, frame, cam):
+        count = cam.next_frame()
+        if self.tracking and not self.collecting(cam):
+            self.track_frame(frame, cam, count)
             return
-        image = self.bridge.imgmsg_to_cv2(ros_image, "bgr8")
-        if self.train:
-            self.collect_face(image)
-            if self.face_count == self.max_face_count:
-                try:
-                    self.faces = []
-                    self.training_job = threading.Thread(target=self.train_model)
-                    self.training_job.deamon = True
-                    self.training_job.start()
-                    while not self.stop_training.is_set() and self.training_job.is_alive():
-                        self.training_job.join(0.2)
-                    if self.training_job.is_alive():
-                        logger.info("Training is interrupted")
-                    else:
-                        logger.info("Training model is finished")
-                except Exception as ex:
-                    logger.error("Train model failed")
-                    logger.error(ex)
-                finally:
-                    self.training_job = None
-                    self.train = False
-                    self.update_parameter({'train': False})
-                    self.update_parameter({'face_name': ''})
-                    self.face_count = 0
+        if self.adaptive_schedule and not self.collecting(cam):
+            # The scene change is measured on a 32x24 thumbnail, the frame
+            # is only decoded for it once min_interval has passed
+            due = self.recognition_due(cam, lambda: frame.preview(0.125), count)
         else:
-            persons, confidences, bboxes = self.infer(image)
+            due = count % self.recognition_interval == 0
+        if not due:
+            self.republish(cam, frame, cam.faces)
+            return
+        if self.collecting(cam):
+            self.collect_face(cam, frame)
+            if self.face_count >= self.max_face_count:
+                cam.faces = []
+                self.start_training(enrolling=True)
+        else:
+            start = time.time()
+            persons, confidences, bboxes, landmarks = self.infer(frame, cam)
             if persons:
+                self.recognized()
                 faces = []
-                for p, c, b in zip(persons, confidences, bboxes):
-                    l = self.face_pose_predictor(image, b)
+                for p, c, b, l in zip(persons, confidences, bboxes, landmarks):
                     faces.append(FaceRecognizer.Face(p,c,b,l))
-                    logger.info("P: {} C: {}".format(p, c))
-                faces = sorted(faces,
-                        key=lambda x: x.bbox.width()*x.bbox.height(), reverse=True)
-                self.faces = faces
-                current = '|'.join([f.name for f in self.faces if f.confidence > self.threshold])
-                self.detected_faces.append(current)
-                rospy.set_param('{}/recent_persons'.format(self.node_name),
-                            ','.join(self.detected_faces))
-                rospy.set_param('{}/current_persons'.format(self.node_name),
-                            current)
-                rospy.set_param('{}/face_visible'.format(self.node_name), True)
+                    logger.info("{}P: {} C: {}".format(cam.prefix, p, c))
+                self.update_persons(cam, faces)
             else:
-                if self.count % 150 == 0: # wait ~5 seconds to let it pick up the face again
-                    self.faces = []
-                    rospy.set_param('{}/face_visible'.format(self.node_name), False)
-                    rospy.set_param('{}/current_persons'.format(self.node_name),'')
-            self.publish_faces(self.faces)
-        self.republish(ros_image, self.faces)
-
-    def publish_faces(self, faces):
-        msgs = Faces()
-        for face in faces:
-            msg = Face()
-            msg.faceid = face.name
-            msg.left = face.bbox.left()
-            msg.top = face.bbox.top()
-            msg.right = face.bbox.right()
-            msg.bottom = face.bbox.bottom()
-            msg.confidence = face.confidence
-            msgs.faces.append(msg)
-        self.faces_pub.publish(msgs)
+                if self.faces_expired(cam, count):
+                    self.clear_persons(cam)
+            self.recognition_done(cam, time.time() - start, bool(persons))
+            self.publish_faces(cam, cam.faces)
+        self.republish(cam, frame, cam.faces)
 
-    def archive(self):
-        archive_fname = os.path.join(DATA_ARCHIVE_DIR, 'faces-{}'.format(
+    def collecting(self, cam):
+        """Whether frames of the camera are collected as samples of face_name"""
+        return self.train and self.training_job is None and cam is self.camera
+
+    def track_frame(self, frame, cam, count):
+        """Move tracked faces on every frame, detect and identify only
+        the new or stale tracks every 30 frames or when a track is lost"""
+        image = frame.bgr
+        tracker = cam.tracker
+        tracker.update(image)
+        detect = tracker.lost or self.recognition_due(cam, image, count)
+        if detect:
+            start = time.time()
+            bb = self.detect_faces(frame, self.multi_faces,
+                [t.box for t in tracker.tracks], cam)
+            pending = tracker.match(image, bb)
+            if pending and (self.recognition_backend == 'gallery' or \
+                    self.clf is not None):
+                reps, boxes, landmarks = self.embed_faces(frame.rgb,
+                    [t.box for t in pending])
+                if len(reps):
+                    names, confidences = self.identify(reps)
+                    aligned = iter(zip(boxes, names, confidences, landmarks))
+                    box, name, confidence, points = next(aligned)
+                    for track in pending:
+                        # embed_faces keeps the order of the boxes it aligned
+                        if track.box is not box:
+                            continue
+                        track.identify(name, confidence, points)
+                        logger.info("Track {} P: {} C: {}".format(
+                            track.id, name, confidence))
+                        box, name, confidence, points = next(aligned,
+                            (None, None, None, None))
+            self.recognition_done(cam, time.time() - start,
+                any(t.name is not None for t in tracker.tracks))
+        faces = [FaceRecognizer.Face(t.name, t.confidence, t.box, t.landmarks)
+            for t in tracker.tracks if t.name is not None]
+        if faces:
+            faces = sorted(faces,
+                key=lambda x: x.bbox.width()*x.bbox.height(), reverse=True)
+            if detect:
+                self.recognized()
+                self.update_persons(cam, faces)
+            else:
+                cam.faces = faces
+        elif cam.faces or cam.face_visible:
+            self.clear_persons(cam)
+        self.publish_faces(cam, cam.faces)
+        self.republish(cam, frame, cam.faces)
+
+    def recognition_due(self, cam, image, count):
+        if not self.adaptive_schedule:
+            return count % self.recognition_interval == 0
+        unconfirmed = any(f.confidence <= self.threshold for f in cam.faces) or \
+            any(t.name is None for t in cam.tracker.tracks)
+        return cam.scheduler.due(image, unconfirmed)
+
+    def recognition_done(self, cam, duration, found):
+        if not self.adaptive_schedule:
+            return
+        cam.scheduler.record(duration, found)
+        cam.schedule_pub.publish(json.dumps(cam.scheduler.decision()))
+
+    def faces_expired(self, cam, count):
+        if not self.adaptive_schedule:
+            # wait ~5 seconds to let it pick up the face again
+            return count % (5*self.recognition_interval) == 0
+        return cam.scheduler.faces_expired()
+
+    def update_persons(self, cam, faces):
+        faces = sorted(faces,
+                key=lambda x: x.bbox.width()*x.bbox.height(), reverse=True)
+        cam.faces = faces
+        current = [f.name for f in cam.faces if f.confidence > self.threshold]
+        cam.detected_faces.append('|'.join(current))
+        cam.face_visible = True
+        self.publish_state(cam, current)
+
+    def clear_persons(self, cam):
+        cam.faces = []
+        cam.face_visible = False
+        self.publish_state(cam, [])
+
+    def publish_state(self, cam, current):
+        with self.profiler.stage('publish'):
+            self._publish_state(cam, current)
+
+    def _publish_state(self, cam, current):
+        msg = PersonState()
+        msg.header.stamp = self.now()
+        msg.current_persons = current
+        msg.recent_persons = list(cam.detected_faces)
+        msg.face_visible = cam.face_visible
+        cam.state_pub.publish(msg)
+        self.param_sync.set(cam.prefix + 'recent_persons', ','.join(cam.detected_faces))
+        self.param_sync.set(cam.prefix + 'current_persons', '|'.join(current))
+        self.param_sync.set(cam.prefix + 'face_visible', cam.face_visible)
+
+    def publish_faces(self, cam, faces):
+        with self.profiler.stage('publish'):
+            msgs = Faces()
+            for face in faces:
+                msg = Face()
+                msg.faceid = face.name
+                msg.left = face.bbox.left()
+                msg.top = face.bbox.top()
+                msg.right = face.bbox.right()
+                msg.bottom = face.bbox.bottom()
+                msg.confidence = face.confidence
+                msgs.faces.append(msg)
+            cam.faces_pub.publish(msgs)
+
+    def publish_diagnostics(self, event=None):
+        summary = self.profiler.summary()
+        status = DiagnosticStatus()
+        status.name = '{}: recognition pipeline'.format(self.node_name)
+        status.hardware_id = self.node_name
+        if self.ready.is_set():
+            status.level = DiagnosticStatus.OK
+            status.message = '{} frames'.format(
+                summary['stages'].get('frame', {}).get('count', 0))
+        else:
+            status.level = DiagnosticStatus.WARN
+            status.message = 'warming up'
+        for name, value in [('ready after', self.startup_time),
+                ('first recognition after', self.first_recognition_time)]:
+            if value is not None:
+                status.values.append(KeyValue(name, '{:.2f}s'.format(value)))
+        for stage, stats in sorted(summary['stages'].items()):
+            for key in ['p50_ms', 'p95_ms', 'p99_ms']:
+                status.values.append(KeyValue(
+                    '{} {}'.format(stage, key), '{:.2f}'.format(stats[key])))
+        for name, value in sorted(summary['counters'].items()):
+            status.values.append(KeyValue(name, str(value)))
+        for cam in self.cameras.values():
+            status.values.append(KeyValue(cam.prefix + 'fps',
+                '{:.2f}'.format(cam.throughput())))
+            if self.pipeline is not None:
+                for name, value in sorted(self.pipeline.slots[cam].stats().items()):
+                    status.values.append(KeyValue(
+                        '{}pipeline {}'.format(cam.prefix, name), str(value)))
+        if self.embedding_pool is not None:
+            for name, value in sorted(self.embedding_pool.stats(reset=True).items()):
+                status.values.append(KeyValue('embedding {}'.format(name), str(value)))
+        msg = DiagnosticArray()
+        msg.header.stamp = self.now()
+        msg.status.append(status)
+        self.diagnostics_pub.publish(msg)
+
+    def dump_profile(self):
+        fname = os.path.join(DATA_DIR, 'profile-{}.json'.format(
                 dt.datetime.strftime(dt.datetime.now(), '%Y%m%d%H%M%S')))
-        shutil.make_archive(archive_fname, 'gztar', root_dir=DATA_DIR)
+        self.profiler.log()
+        self.profiler.dump(fname)
+
+    def archive(self):
+        """Snapshot DATA_DIR in the background. A request while a snapshot
+        is running is served by one more snapshot after it."""
+        with self._snapshot_lock:
+            if self.snapshot_job is not None:
+                self._snapshot_again = True
+                return
+            self.snapshot_job = threading.Thread(target=self._archive, name='snapshot')
+            self.snapshot_job.daemon = True
+            self.snapshot_job.start()
+
+    def _archive(self):
+        while True:
+            try:
+                # Training and forgetting rewrite the stores
+                with self._train_lock:
+                    self.snapshots.snapshot(DATA_DIR, SNAPSHOT_EXCLUDE)
+                self.snapshots.prune()
+            except Exception as ex:
+                logger.error("Snapshot failed")
+                logger.error(ex)
+            with self._snapshot_lock:
+                if not self._snapshot_again:
+                    self.snapshot_job = None
+                    return
+                self._snapshot_again = False
+
+    def restore(self, snapshot_id=None):
+        """Restore a snapshot, the latest by default, and reload the model"""
+        snapshot_id = snapshot_id or self.snapshots.latest()
+        if snapshot_id is None:
+            logger.error("No snapshot to restore")
+            return
+        self.stop_training.set()
+        with self._train_lock:
+            with self._lock:
+                self.snapshots.restore(snapshot_id, DATA_DIR, SNAPSHOT_EXCLUDE)
+                classifier = os.path.join(CLASSIFIER_DIR, 'classifier.pkl')
+                if not os.path.isfile(classifier):
+                    classifier = os.path.join(DEFAULT_CLASSIFIER_DIR, 'classifier.pkl')
+                self.load_classifier(classifier)
+                self.known_names = set(self.get_param('known_names', []))
+                self.known_names.update(self.local_store().classes)
+                self.gallery = None
+        logger.warn("Restored snapshot {}".format(snapshot_id))
 
     def reset(self):
-        shutil.rmtree(self.train_dir, ignore_errors=True)
-        shutil.rmtree(self.aligned_dir, ignore_errors=True)
-        shutil.rmtree(os.path.join(CLASSIFIER_DIR, 'classifier.pkl'), ignore_errors=True)
-        self.load_classifier(os.path.join(DEFAULT_CLASSIFIER_DIR, 'classifier.pkl'))
+        """Forget the locally enrolled identities. The samples are moved out
+        of the way and deleted after the model is reset. Runs in its own
+        thread, as it waits for training and snapshots to finish."""
+        self.stop_training.set()
+        with self._train_lock:
+            with self._lock:
+                trash = tempfile.mkdtemp(prefix='.trash-', dir=DATA_DIR)
+                for d in [self.train_dir, self.aligned_dir]:
+                    if os.path.isdir(d):
+                        os.rename(d, os.path.join(trash, os.path.basename(d)))
+                self.local_store().clear()
+                for fname in ['classifier.pkl', 'local_reps.csv', 'local_labels.csv']:
+                    fname = os.path.join(CLASSIFIER_DIR, fname)
+                    if os.path.isfile(fname):
+                        os.remove(fname)
+                self.load_classifier(os.path.join(DEFAULT_CLASSIFIER_DIR, 'classifier.pkl'))
+                self.known_names = set(self.get_param('known_names', []))
+                self.gallery = None
         logger.warn("Model is reset to default")
+        shutil.rmtree(trash, ignore_errors=True)
+
+    def run_reset(self):
+        try:
+            self.reset()
+        except Exception as ex:
+            logger.error("Reset failed")
+            logger.error(ex)
 
     def save_model(self):
-        files = ['labels.csv', 'reps.csv', 'classifier.pkl']
-        files = [os.path.join(self.aligned_dir, f) for f in files]
-        if all([os.path.isfile(f) for f in files]):
-            for f in files:
-                shutil.copy(f, os.path.join(CLASSIFIER_DIR))
-            logger.info("Model is saved")
-            self.archive()
-            return True
-        logger.info("Model is not saved")
-        return False
+        """The model is saved by training, take a snapshot of it and the samples"""
+        self.archive()
+        logger.info("Snapshot is requested")
+        return True
 
     def update_parameter(self, param):
+        if self.offline:
+            return False
         client = dynamic_reconfigure.client.Client(self.node_name, timeout=2)
         try:
             client.update_configuration(param)
@@ -453,8 +1126,16 @@ class FaceRecognizer(object):
         if config.save:
             self.save_model()
             config.save = False
+        if config.restore:
+            job = threading.Thread(target=self.restore,
+                args=(config.snapshot_id or None,), name='restore')
+            job.daemon = True
+            job.start()
+            config.restore = False
+        if config.dump_profile:
+            self.dump_profile()
+            config.dump_profile = False
         if self.train and not config.train:
-            # TODO: stop training if it's started
             logger.info("Stopping")
             self.train = False
             self.stop_training.set()
@@ -467,6 +1148,7 @@ class FaceRecognizer(object):
                 self.event_pub.publish('start')
                 self.stop_training.clear()
                 self.face_count = 0
+                self.sample_gate.reset(self.enrolled_reps(self.face_name))
             else:
                 self.train = False
                 config.train = False
@@ -474,14 +1156,49 @@ class FaceRecognizer(object):
         self.threshold = config.confidence_threshold
         self.multi_faces = config.multi_faces
         self.max_face_count = config.max_face_count
+        self.incremental = config.incremental
+        self.classifier_backend = config.classifier_backend
+        self.gate_samples = config.sample_gate
+        self.sample_gate.min_size = config.min_sample_size
+        self.sample_gate.min_sharpness = config.min_sample_sharpness
+        self.sample_gate.max_yaw = config.max_sample_yaw
+        self.sample_gate.min_distance = config.min_sample_distance
+        self.crop_samples = config.crop_samples
+        self.crop_padding = config.crop_padding
+        for cam in self.cameras.values():
+            cam.reconfig(config, self.tracking)
+        self.tracking = config.tracking
+        self.param_sync.min_interval = config.param_sync_interval
+        self.debug_image_rate = config.debug_image_rate
+        self.debug_image_scale = config.debug_image_scale
+        self.debug_jpeg_quality = config.debug_jpeg_quality
+        self.adaptive_schedule = config.adaptive_schedule
+        if config.recognition_backend != self.recognition_backend or \
+                config.gallery_approximate != self.gallery_approximate:
+            self.gallery = None
+        self.recognition_backend = config.recognition_backend
+        self.gallery_threshold = config.gallery_threshold
+        self.gallery_approximate = config.gallery_approximate
+        if config.retrain:
+            self.start_training(full=True)
+            config.retrain = False
+        if config.forget:
+            if config.face_name:
+                job = threading.Thread(target=self.forget, args=(config.face_name.lower(),))
+                job.daemon = True
+                job.start()
+            else:
+                logger.error("Name is not set")
+            config.forget = False
         if config.reset:
             config.train = False
             self.train = False
             time.sleep(0.2)
-            try:
-                self.reset()
-            except Exception as ex:
-                logger.error(ex)
+            # Resetting waits for a running snapshot, which must not
+            # hold up the reconfigure callback
+            job = threading.Thread(target=self.run_reset, name='reset')
+            job.daemon = True
+            job.start()
             config.reset = False
         return config
 
@@ -489,7 +1206,14 @@ if __name__ == '__main__':
     rospy.init_node("face_recognizer")
     recognizer = FaceRecognizer()
     Server(FaceRecognitionConfig, recognizer.reconfig)
-    rospy.Subscriber('/camera/image_raw', Image, recognizer.image_cb)
+    for cam in recognizer.cameras.values():
+        msg_type = CompressedImage if cam.topic.endswith('/compressed') else Image
+        rospy.Subscriber(cam.topic, msg_type, recognizer.image_cb, cam)
+    if recognizer.pipeline is not None:
+        rospy.on_shutdown(recognizer.pipeline.stop)
+    rospy.on_shutdown(recognizer.param_sync.stop)
+    if recognizer.embedding_pool is not None:
+        rospy.on_shutdown(recognizer.embedding_pool.close)
     rospy.spin()
 
     #logging.basicConfig()
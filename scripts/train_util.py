@@ -1,15 +1,18 @@
 # Copyright (c) 2013-2018 Hanson Robotics, Ltd. 
 import os
-import cv2
-import dlib
+import sys
+import argparse
+import multiprocessing
 import openface
-import random
-import pandas as pd
 import logging
-import pickle
-from openface.data import iterImgs
-from sklearn.preprocessing import LabelEncoder
-from sklearn.svm import SVC
+from ros_face_recognition.alignment import AlignmentEngine
+from ros_face_recognition.embedding_cache import EmbeddingCache
+from ros_face_recognition.rep_store import RepStore, migrate_csv
+from ros_face_recognition.rep_generator import RepGenerator
+from ros_face_recognition.embedding import EMBEDDERS
+from ros_face_recognition.embedding_pool import EmbeddingPool
+from ros_face_recognition.classifiers import (BACKENDS, fit_backend,
+    save_model, compare_incremental)
 
 HR_MODELS = os.environ.get('HR_MODELS', os.path.expanduser('~/.hr/cache/models'))
 DLIB_FACEPREDICTOR = os.path.join(HR_MODELS,
@@ -21,109 +24,119 @@ logger = logging.getLogger('hr.ros_face_recognition.train_util')
 
 class TrainUtil(object):
 
-    def __init__(self, train_dir, aligned_dir, classifier_dir):
+    def __init__(self, train_dir, aligned_dir, classifier_dir, align_workers=1,
+                 embed_workers=1, chunk_size=256, use_cache=True,
+                 embedding_backend='opencv', embed_batch=64):
         self.train_dir = train_dir
         self.aligned_dir = aligned_dir
         self.classifier_dir = classifier_dir
 
-        self.align = openface.AlignDlib(DLIB_FACEPREDICTOR)
         self.landmarkIndices = openface.AlignDlib.OUTER_EYES_AND_NOSE
         self.imgDim = 96
-        self.net = openface.TorchNeuralNet(NETWORK_MODEL, self.imgDim)
+        self.align_engine = AlignmentEngine(DLIB_FACEPREDICTOR, self.imgDim,
+            self.landmarkIndices, align_workers)
+        self.embedding_pool = EmbeddingPool(embedding_backend, NETWORK_MODEL,
+            self.imgDim, embed_workers, bulk_chunk=embed_batch)
+        self.rep_generator = RepGenerator(self.embedding_pool, chunk_size)
+        self.embedding_backend = embedding_backend
+        self.use_cache = use_cache
         for d in [self.train_dir, self.aligned_dir, self.classifier_dir]:
             if not os.path.isdir(d):
                 os.makedirs(d)
 
-    def align_images(self):
-        imgs = list(iterImgs(self.train_dir))
-        # Shuffle so multiple versions can be run at once.
-        random.shuffle(imgs)
-        n_total = len(imgs)
-
-        for i, imgObject in enumerate(imgs, 1):
-            outDir = os.path.join(self.aligned_dir, imgObject.cls)
-            if not os.path.isdir(outDir):
-                os.makedirs(outDir)
-            outputPrefix = os.path.join(outDir, imgObject.name)
-            imgName = outputPrefix + ".png"
-
-            if not os.path.isfile(imgName):
-                rgb = imgObject.getRGB()
-                if rgb is None:
-                    outRgb = None
-                else:
-                    outRgb = self.align.align(
-                            self.imgDim, rgb,
-                            landmarkIndices=self.landmarkIndices)
-                if outRgb is not None:
-                    outBgr = cv2.cvtColor(outRgb, cv2.COLOR_RGB2BGR)
-                    cv2.imwrite(imgName, outBgr)
-                    logger.info("Write image {}".format(imgName))
-                else:
-                    os.remove(imgObject.path)
-                    logger.warn("No face was detected in {}. Removed.".format(imgObject.path))
-            logger.info("{}/{}".format(i, n_total))
-
-    def gen_data(self):
-        face_reps = []
-        labels = []
-        reps_fname = "{}/reps.csv".format(self.classifier_dir)
-        label_fname = "{}/labels.csv".format(self.classifier_dir)
-
-        imgs = list(iterImgs(self.aligned_dir))
-        n_total = len(imgs)
-        for i, imgObject in enumerate(imgs, 1):
-            reps = self.net.forward(imgObject.getRGB())
-            face_reps.append(reps)
-            labels.append((imgObject.cls, imgObject.name))
-            logger.info("{}/{}".format(i, n_total))
-
-        if face_reps and labels:
-            pd.DataFrame(face_reps).to_csv(reps_fname, header=False, index=False)
-            pd.DataFrame(labels).to_csv(label_fname, header=False, index=False)
-            logger.info("Generated label file {}".format(label_fname))
-            logger.info("Generated representation file {}".format(reps_fname))
-
-    def train_model(self):
-        label_fname = "{}/labels.csv".format(self.classifier_dir)
-        reps_fname = "{}/reps.csv".format(self.classifier_dir)
+    def align_images(self, resume=True):
+        self.align_engine.run(self.train_dir, self.aligned_dir, resume=resume)
+
+    def rep_store(self):
+        store = RepStore(self.classifier_dir, 'reps')
+        migrate_csv(store, "{}/reps.csv".format(self.classifier_dir),
+            "{}/labels.csv".format(self.classifier_dir))
+        return store
+
+    def gen_data(self, resume=True):
+        cache = None
+        if self.use_cache:
+            cache = EmbeddingCache(
+                os.path.join(self.classifier_dir, 'embeddings.pkl'), NETWORK_MODEL,
+                self.embedding_backend)
+        store = RepStore(self.classifier_dir, 'reps')
+        if self.rep_generator.run(self.aligned_dir, store, cache, resume):
+            logger.info("Generated representation store {}".format(store.meta_fname))
+
+    def compare_incremental(self):
+        """Measure the accuracy of incremental enrollment against a full retrain"""
+        embeddings_data, labels_data = self.rep_store().load()
+        result = compare_incremental(embeddings_data, labels_data)
+        logger.info("Accuracy full retrain {full:.4f}, incremental {incremental:.4f}, "
+            "gap {gap:.4f}".format(**result))
+        return result
+
+    def train_model(self, backend='svc'):
         classifier_fname = "{}/classifier.pkl".format(self.classifier_dir)
 
-        labels, embeddings = None, None
-        if os.path.isfile(label_fname) and \
-                    os.path.isfile(reps_fname):
-            labels = pd.read_csv(label_fname, header=None)
-            embeddings = pd.read_csv(reps_fname, header=None)
-
-        if labels is None or embeddings is None:
+        embeddings_data, labels_data = self.rep_store().load()
+        if len(labels_data) == 0:
             logger.error("No labels or representations are found")
             return
 
-        labels_data = labels.as_matrix()[:,0].tolist()
-        embeddings_data = embeddings.as_matrix()
-
-        le = LabelEncoder().fit(labels_data)
-        labelsNum = le.transform(labels_data)
-        clf = SVC(C=1, kernel='linear', probability=True)
         try:
-            logger.info("Start training")
-            clf.fit(embeddings_data, labelsNum)
+            logger.info("Start training {} model".format(backend))
+            le, clf = fit_backend(backend, embeddings_data, labels_data)
         except ValueError as ex:
             logger.error(ex)
             return
 
-        with open(classifier_fname, 'w') as f:
-            pickle.dump((le, clf), f)
+        save_model(classifier_fname, le, clf, backend)
         logger.info("Model saved to {}".format(classifier_fname))
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--root-dir', default='lfw',
+        help='directory containing training-images')
+    parser.add_argument('--align-workers', type=int,
+        default=multiprocessing.cpu_count(),
+        help='number of alignment processes')
+    parser.add_argument('--embed-workers', type=int, default=1,
+        help='number of embedding processes, each runs its own network')
+    parser.add_argument('--embedding-backend', choices=list(EMBEDDERS),
+        default='opencv', help='how the network is run')
+    parser.add_argument('--embed-batch', type=int, default=64,
+        help='number of faces sent to an embedding process at a time')
+    parser.add_argument('--chunk-size', type=int, default=256,
+        help='number of images embedded and stored at a time')
+    parser.add_argument('--no-cache', action='store_true',
+        help='do not keep the embedding cache, which holds every representation '
+             'in memory')
+    parser.add_argument('--no-resume', action='store_true',
+        help='ignore the alignment and embedding checkpoints and start over')
+    parser.add_argument('--backend', choices=list(BACKENDS), default='svc',
+        help='classifier backend')
+    parser.add_argument('--incremental', action='store_true',
+        help='train a model that supports incremental enrollment, '
+             'same as --backend incremental')
+    parser.add_argument('--compare-incremental', type=float, metavar='TOLERANCE',
+        help='fail if incremental enrollment is less accurate than a full '
+             'retrain by more than TOLERANCE')
+    args = parser.parse_args()
+
     BASIC_FORMAT = "%(asctime)s:%(levelname)s:%(name)s:%(message)s"
     logging.basicConfig(format=BASIC_FORMAT, level=logging.INFO)
-    root_dir = 'lfw'
+    root_dir = args.root_dir
     train_dir = os.path.join(root_dir, 'training-images')
     aligned_dir = os.path.join(root_dir, 'aligned-images')
     classifier_dir = os.path.join(root_dir, 'classifier')
-    util = TrainUtil(train_dir, aligned_dir, classifier_dir)
-    util.align_images()
-    util.gen_data()
-    util.train_model()
+    util = TrainUtil(train_dir, aligned_dir, classifier_dir, args.align_workers,
+        args.embed_workers, args.chunk_size, not args.no_cache,
+        args.embedding_backend, args.embed_batch)
+    util.align_images(not args.no_resume)
+    try:
+        util.gen_data(not args.no_resume)
+    finally:
+        util.embedding_pool.close()
+    if args.compare_incremental is not None:
+        result = util.compare_incremental()
+        if result['gap'] > args.compare_incremental:
+            logger.error("Accuracy gap {:.4f} exceeds tolerance {}".format(
+                result['gap'], args.compare_incremental))
+            sys.exit(1)
+    util.train_model('incremental' if args.incremental else args.backend)
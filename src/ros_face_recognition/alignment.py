@@ -0,0 +1,165 @@
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd.
+import os
+import cv2
+import random
+import logging
+import multiprocessing
+import openface
+from openface.data import iterImgs
+
+logger = logging.getLogger('hr.vision.ros_face_recognition.alignment')
+
+JOBS_FNAME = '.align-jobs'
+DONE_FNAME = '.align-done'
+
+ALIGNED = 'aligned'
+NO_FACE = 'noface'
+FAILED = 'failed'
+
+_worker = None
+
+def _init_worker(predictor, img_dim, landmark_indices):
+    # Each worker process loads its own predictor
+    global _worker
+    _worker = (openface.AlignDlib(predictor), img_dim, landmark_indices)
+
+def _align_job(job):
+    src, dst = job
+    align, img_dim, landmark_indices = _worker
+    try:
+        return src, dst, align_file(align, img_dim, landmark_indices, src, dst)
+    except Exception as ex:
+        logger.error(ex)
+        return src, dst, FAILED
+
+def align_file(align, img_dim, landmark_indices, src, dst):
+    bgr = cv2.imread(src)
+    if bgr is None:
+        return NO_FACE
+    rgb = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+    outRgb = align.align(img_dim, rgb, landmarkIndices=landmark_indices)
+    if outRgb is None:
+        return NO_FACE
+    cv2.imwrite(dst, cv2.cvtColor(outRgb, cv2.COLOR_RGB2BGR))
+    return ALIGNED
+
+class AlignmentEngine(object):
+    """Align a tree of images with a pool of worker processes
+
+    Pending jobs are written to a checkpoint in the output directory and
+    every finished image is appended to a done log, so an interrupted run
+    resumes from the remaining jobs without listing the input tree or
+    checking existing outputs again.
+    """
+
+    def __init__(self, predictor, img_dim, landmark_indices, workers=1, align=None):
+        self.predictor = predictor
+        self.img_dim = img_dim
+        self.landmark_indices = landmark_indices
+        self.workers = max(1, workers)
+        self.align = align
+
+    def list_jobs(self, input_dir, output_dir):
+        jobs = []
+        for imgObject in iterImgs(input_dir):
+            outDir = os.path.join(output_dir, imgObject.cls)
+            if not os.path.isdir(outDir):
+                os.makedirs(outDir)
+            imgName = os.path.join(outDir, imgObject.name) + ".png"
+            if not os.path.isfile(imgName):
+                jobs.append((imgObject.path, imgName))
+            else:
+                logger.debug("Skip existing aligned image %s", imgName)
+        # Shuffle so multiple versions can be run at once.
+        random.shuffle(jobs)
+        return jobs
+
+    def load_checkpoint(self, output_dir):
+        jobs_fname = os.path.join(output_dir, JOBS_FNAME)
+        done_fname = os.path.join(output_dir, DONE_FNAME)
+        if not os.path.isfile(jobs_fname):
+            return None
+        with open(jobs_fname) as f:
+            jobs = [tuple(line.rstrip('\n').split('\t')) for line in f if line.strip()]
+        done = set()
+        if os.path.isfile(done_fname):
+            with open(done_fname) as f:
+                done = set(line.rstrip('\n') for line in f)
+        return [job for job in jobs if job[0] not in done]
+
+    def save_checkpoint(self, output_dir, jobs):
+        jobs_fname = os.path.join(output_dir, JOBS_FNAME)
+        tmp_fname = jobs_fname + '.tmp'
+        with open(tmp_fname, 'w') as f:
+            for src, dst in jobs:
+                f.write('{}\t{}\n'.format(src, dst))
+        os.rename(tmp_fname, jobs_fname)
+        done_fname = os.path.join(output_dir, DONE_FNAME)
+        if os.path.isfile(done_fname):
+            os.remove(done_fname)
+
+    def clear_checkpoint(self, output_dir):
+        for fname in [JOBS_FNAME, DONE_FNAME]:
+            fname = os.path.join(output_dir, fname)
+            if os.path.isfile(fname):
+                os.remove(fname)
+
+    def _results(self, jobs):
+        if self.workers == 1:
+            if self.align is None:
+                self.align = openface.AlignDlib(self.predictor)
+            for src, dst in jobs:
+                try:
+                    status = align_file(self.align, self.img_dim,
+                        self.landmark_indices, src, dst)
+                except Exception as ex:
+                    logger.error(ex)
+                    status = FAILED
+                yield src, dst, status
+            return
+        pool = multiprocessing.Pool(self.workers, _init_worker,
+            (self.predictor, self.img_dim, self.landmark_indices))
+        try:
+            for result in pool.imap_unordered(_align_job, jobs, chunksize=4):
+                yield result
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def run(self, input_dir, output_dir, should_stop=None, resume=True,
+            progress=None):
+        """Align all images under input_dir into output_dir, calling
+        progress(done, total) after each image.
+        Returns the number of aligned images or None if stopped."""
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+        jobs = self.load_checkpoint(output_dir) if resume else None
+        if jobs is None:
+            jobs = self.list_jobs(input_dir, output_dir)
+            self.save_checkpoint(output_dir, jobs)
+        else:
+            logger.info("Resuming alignment, {} images left".format(len(jobs)))
+        n_total = len(jobs)
+        n_aligned = 0
+        with open(os.path.join(output_dir, DONE_FNAME), 'a') as done:
+            results = self._results(jobs)
+            for i, (src, dst, status) in enumerate(results, 1):
+                if status == ALIGNED:
+                    n_aligned += 1
+                    logger.info("Write image {}".format(dst))
+                elif status == NO_FACE:
+                    if os.path.isfile(src):
+                        os.remove(src)
+                    logger.warn("No face was detected in {}. Removed.".format(src))
+                done.write(src + '\n')
+                done.flush()
+                logger.info("{}/{}".format(i, n_total))
+                if progress is not None:
+                    progress(i, n_total)
+                if should_stop is not None and should_stop():
+                    results.close()
+                    logger.info("Alignment is interrupted")
+                    return None
+        self.clear_checkpoint(output_dir)
+        return n_aligned
@@ -0,0 +1,79 @@
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd.
+import time
+import logging
+import threading
+from collections import deque
+from ros_face_recognition.detection import FaceDetector
+from ros_face_recognition.tracking import FaceTracker
+from ros_face_recognition.scheduler import RecognitionScheduler
+
+logger = logging.getLogger('hr.vision.ros_face_recognition.camera')
+
+def camera_name(topic):
+    """Name a camera after the namespace of its image topic, e.g.
+    /camera/image_raw is camera and /head/left/image_raw/compressed is
+    head_left"""
+    parts = [part for part in topic.split('/') if part]
+    if len(parts) > 1 and parts[-1] == 'compressed':
+        parts = parts[:-1]
+    if len(parts) > 1:
+        parts = parts[:-1]
+    return '_'.join(parts)
+
+class CameraContext(object):
+    """Recognition state of one camera
+
+    The models and the classifier are shared by all cameras. The frame
+    count, detection priors, tracks, schedule, recognized persons and
+    output publishers belong to the camera. prefix is prepended to the
+    output topics and synced parameters, it is empty for a single camera.
+    """
+
+    def __init__(self, name, topic, detector, prefix=''):
+        self.name = name
+        self.topic = topic
+        self.prefix = prefix
+        self.count = 0
+        self.faces = []
+        self.detected_faces = deque(maxlen=10)
+        self.face_visible = False
+        self.face_detector = FaceDetector(detector)
+        self.tracker = FaceTracker()
+        self.scheduler = RecognitionScheduler()
+        self.last_debug_image = 0
+        self._count_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self._last_report = (time.time(), 0)
+
+    def __str__(self):
+        return self.name
+
+    def next_frame(self):
+        with self._count_lock:
+            self.count += 1
+            return self.count
+
+    def reconfig(self, config, tracking):
+        if tracking and not config.tracking:
+            self.tracker.clear()
+        self.scheduler.max_cpu_share = config.max_cpu_share
+        self.scheduler.min_interval = config.min_recognition_interval
+        self.scheduler.freshness_deadline = config.freshness_deadline
+        self.scheduler.face_timeout = config.face_timeout
+        self.scheduler.change_threshold = config.scene_change_threshold
+        self.face_detector.scale = config.detect_scale
+        self.face_detector.upsample = config.detect_upsample
+        self.face_detector.roi_search = config.roi_search
+        self.face_detector.roi_margin = config.roi_margin
+        self.face_detector.full_scan_interval = config.full_scan_interval
+        self.tracker.refresh = config.track_refresh
+        self.tracker.min_quality = config.track_min_quality
+
+    def throughput(self):
+        """Frames per second since the last call"""
+        now, count = time.time(), self.count
+        last_time, last_count = self._last_report
+        self._last_report = (now, count)
+        if now <= last_time:
+            return 0.0
+        return (count - last_count)/(now - last_time)
@@ -0,0 +1,258 @@
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd.
+import os
+import time
+import pickle
+import logging
+from collections import OrderedDict
+import numpy as np
+
+logger = logging.getLogger('hr.vision.ros_face_recognition.classifiers')
+
+class IncrementalOVR(object):
+    """One-vs-rest linear classifier over face representations
+
+    Each identity has its own logistic model trained on its samples
+    against a bounded random sample of the other identities, so adding or
+    removing an identity only fits that identity and leaves the other
+    models untouched. Labels are the identity names, classes_ is sorted
+    like LabelEncoder.classes_.
+    """
+
+    def __init__(self, C=1.0, neg_ratio=10, min_negatives=100,
+                 max_negatives=2000, random_state=0):
+        self.C = C
+        self.neg_ratio = neg_ratio
+        self.min_negatives = min_negatives
+        self.max_negatives = max_negatives
+        self.random_state = random_state
+        self.models = {}
+        self._update()
+
+    def _update(self):
+        self.classes_ = np.array(sorted(self.models), dtype=object)
+        if self.models:
+            self._coef = np.vstack([self.models[c][0] for c in self.classes_])
+            self._intercept = np.array([self.models[c][1] for c in self.classes_])
+        else:
+            self._coef, self._intercept = None, None
+
+    def fit(self, X, y, should_stop=None):
+        """Fit every identity. Returns None if should_stop() turns true
+        between two identities."""
+        self.models = {}
+        y = np.asarray(y)
+        for label in np.unique(y):
+            if should_stop is not None and should_stop():
+                return None
+            self._fit_class(X, y, label)
+        self._update()
+        return self
+
+    def update(self, X, y, labels):
+        """Refit only the given identities and drop identities no longer in y"""
+        y = np.asarray(y)
+        present = set(np.unique(y))
+        for label in list(self.models):
+            if label not in present:
+                logger.info("Remove identity {}".format(label))
+                del self.models[label]
+        for label in labels:
+            if label in present:
+                self._fit_class(X, y, label)
+        self._update()
+        return self
+
+    def remove(self, label):
+        self.models.pop(label, None)
+        self._update()
+
+    def _fit_class(self, X, y, label):
+        from sklearn.linear_model import LogisticRegression
+        pos = np.flatnonzero(y == label)
+        neg = np.flatnonzero(y != label)
+        if len(neg) == 0:
+            raise ValueError("Need samples of at least two identities")
+        rng = np.random.RandomState(self.random_state)
+        n_neg = min(len(neg), self.max_negatives,
+            max(self.min_negatives, self.neg_ratio*len(pos)))
+        neg = rng.choice(neg, n_neg, replace=False)
+        idx = np.concatenate([pos, neg])
+        target = np.zeros(len(idx), dtype=int)
+        target[:len(pos)] = 1
+        clf = LogisticRegression(C=self.C, class_weight='balanced')
+        clf.fit(X[idx], target)
+        self.models[label] = (clf.coef_.ravel().astype(np.float32),
+                              float(clf.intercept_[0]))
+
+    def decision_function(self, X):
+        return np.dot(X, self._coef.T) + self._intercept
+
+    def predict_proba(self, X):
+        prob = 1.0/(1.0 + np.exp(-self.decision_function(X)))
+        if prob.ndim == 1:
+            prob = prob.reshape(1, -1)
+        return prob/prob.sum(axis=1, keepdims=True)
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.decision_function(X), axis=1)]
+
+class NearestClassMean(object):
+    """Nearest class mean over face representations
+
+    Fitting only averages the representations of each identity, and
+    prediction is one distance per identity. Probabilities are a softmax
+    of the negative squared distances divided by temperature.
+    """
+
+    def __init__(self, temperature=0.05):
+        self.temperature = temperature
+        self.classes_ = np.array([], dtype=object)
+        self.means_ = None
+
+    def fit(self, X, y, should_stop=None):
+        X = np.asarray(X, dtype=np.float32)
+        y = np.asarray(y)
+        self.classes_ = np.array(sorted(np.unique(y)), dtype=object)
+        if len(self.classes_) < 2:
+            raise ValueError("Need samples of at least two identities")
+        self.means_ = np.vstack([X[y == c].mean(axis=0) for c in self.classes_])
+        return self
+
+    def decision_function(self, X):
+        X = np.atleast_2d(np.asarray(X, dtype=np.float32))
+        d = (X*X).sum(axis=1)[:, None] - 2*np.dot(X, self.means_.T) + \
+            (self.means_*self.means_).sum(axis=1)
+        return -np.maximum(d, 0)
+
+    def predict_proba(self, X):
+        z = self.decision_function(X)/self.temperature
+        z -= z.max(axis=1, keepdims=True)
+        prob = np.exp(z)
+        return prob/prob.sum(axis=1, keepdims=True)
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.decision_function(X), axis=1)]
+
+def label_encoder(classes):
+    """LabelEncoder that maps to the given sorted class names"""
+    from sklearn.preprocessing import LabelEncoder
+    le = LabelEncoder()
+    le.classes_ = np.asarray(classes)
+    return le
+
+def compare_incremental(X, y, test_size=0.25, random_state=0):
+    """Accuracy of a full SVC retrain vs an incrementally built model
+
+    The incremental model is built one identity at a time with update(),
+    the way enrollment builds it on the robot.
+    """
+    from sklearn.model_selection import train_test_split
+    from sklearn.preprocessing import LabelEncoder
+    from sklearn.svm import SVC
+    X = np.asarray(X)
+    y = np.asarray(y)
+    X_train, X_test, y_train, y_test = train_test_split(X, y,
+        test_size=test_size, random_state=random_state)
+
+    le = LabelEncoder().fit(y_train)
+    svc = SVC(C=1, kernel='linear', probability=True)
+    svc.fit(X_train, le.transform(y_train))
+    full = np.mean(le.inverse_transform(svc.predict(X_test)) == y_test)
+
+    clf = IncrementalOVR(random_state=random_state)
+    labels = np.unique(y_train)
+    seen = (y_train == labels[0]) | (y_train == labels[1])
+    clf.fit(X_train[seen], y_train[seen])
+    for label in labels[2:]:
+        seen |= y_train == label
+        clf.update(X_train[seen], y_train[seen], [label])
+    incremental = np.mean(clf.predict(X_test) == y_test)
+    return {'full': float(full), 'incremental': float(incremental),
+            'gap': float(full - incremental)}
+
+def fit_svc(X, y, should_stop=None):
+    from sklearn.preprocessing import LabelEncoder
+    from sklearn.svm import SVC
+    le = LabelEncoder().fit(y)
+    clf = SVC(C=1, kernel='linear', probability=True)
+    clf.fit(X, le.transform(y))
+    return le, clf
+
+def fit_linear(X, y, should_stop=None):
+    # Multinomial logistic regression is calibrated by its own loss, no
+    # cross-validated Platt scaling like SVC(probability=True) needs
+    from sklearn.preprocessing import LabelEncoder
+    from sklearn.linear_model import LogisticRegression
+    le = LabelEncoder().fit(y)
+    try:
+        clf = LogisticRegression(C=10, solver='lbfgs', multi_class='multinomial',
+            max_iter=1000)
+    except TypeError:
+        # scikit-learn dropped multi_class, lbfgs is multinomial there
+        clf = LogisticRegression(C=10, solver='lbfgs', max_iter=1000)
+    clf.fit(X, le.transform(y))
+    return le, clf
+
+def fit_ncm(X, y, should_stop=None):
+    clf = NearestClassMean().fit(X, y)
+    return label_encoder(clf.classes_), clf
+
+def fit_incremental(X, y, should_stop=None):
+    clf = IncrementalOVR().fit(X, y, should_stop=should_stop)
+    if clf is None:
+        return None, None
+    return label_encoder(clf.classes_), clf
+
+BACKENDS = OrderedDict([
+    ('svc', fit_svc),
+    ('linear', fit_linear),
+    ('ncm', fit_ncm),
+    ('incremental', fit_incremental),
+])
+
+def fit_backend(backend, X, y, should_stop=None):
+    """Fit (le, clf) with a backend of BACKENDS. Returns (None, None) if
+    should_stop() turns true and the backend can be stopped."""
+    if backend not in BACKENDS:
+        raise ValueError("Unknown classifier backend {}".format(backend))
+    return BACKENDS[backend](np.asarray(X), np.asarray(y), should_stop)
+
+MODEL_VERSION = 1
+
+def backend_of(clf):
+    if isinstance(clf, IncrementalOVR):
+        return 'incremental'
+    if isinstance(clf, NearestClassMean):
+        return 'ncm'
+    # sklearn is only imported when a model is fitted
+    if type(clf).__name__ == 'LogisticRegression':
+        return 'linear'
+    return 'svc'
+
+def save_model(fname, le, clf, backend=None):
+    """Write classifier.pkl atomically. Besides (le, clf) it records the
+    format version, the backend, the classes and when it was trained."""
+    tmp_fname = fname + '.tmp'
+    with open(tmp_fname, 'wb') as f:
+        pickle.dump({
+            'version': MODEL_VERSION,
+            'backend': backend or backend_of(clf),
+            'classes': [str(c) for c in le.classes_],
+            'created': time.time(),
+            'le': le,
+            'clf': clf,
+        }, f, pickle.HIGHEST_PROTOCOL)
+    os.rename(tmp_fname, fname)
+
+def load_model(fname):
+    """Return (le, clf, backend) of classifier.pkl. Files written before
+    the format was versioned hold a bare (le, clf) tuple."""
+    with open(fname, 'rb') as f:
+        data = pickle.load(f)
+    if isinstance(data, tuple):
+        le, clf = data
+        return le, clf, backend_of(clf)
+    if data.get('version', 0) > MODEL_VERSION:
+        raise ValueError("{} has unsupported version {}".format(
+            fname, data.get('version')))
+    return data['le'], data['clf'], data['backend']
@@ -0,0 +1,85 @@
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd.
+import logging
+import cv2
+import dlib
+import numpy as np
+
+logger = logging.getLogger('hr.vision.ros_face_recognition.detection')
+
+def scale_rect(rect, scale, dx=0, dy=0):
+    return dlib.rectangle(int(rect.left()/scale) + dx, int(rect.top()/scale) + dy,
+        int(rect.right()/scale) + dx, int(rect.bottom()/scale) + dy)
+
+def overlap(a, b):
+    inter = a.intersect(b)
+    if inter.is_empty():
+        return 0.0
+    return float(inter.area())/min(a.area(), b.area())
+
+class FaceDetector(object):
+    """HOG face detector working on a downscaled copy of the frame
+
+    With roi_search the regions around the faces of the previous frame are
+    scanned first. The whole frame is scanned when there is no previous
+    face, when a previous face is not found again or every
+    full_scan_interval calls. A full scan can use an (image, scale) copy
+    of the frame that is already reduced, e.g. decoded at a lower
+    resolution, and the frame can be given as a function returning it,
+    so a frame that is only scanned at the reduced resolution is never
+    needed at full resolution.
+    """
+
+    def __init__(self, detector=None, scale=1.0, upsample=1, roi_search=False,
+                 roi_margin=0.5, full_scan_interval=5):
+        self.detector = detector or dlib.get_frontal_face_detector()
+        self.scale = scale
+        self.upsample = upsample
+        self.roi_search = roi_search
+        self.roi_margin = roi_margin
+        self.full_scan_interval = full_scan_interval
+        self.since_full_scan = 0
+
+    def _detect(self, img, dx=0, dy=0, img_scale=1.0):
+        scale = self.scale
+        if scale != img_scale:
+            img = cv2.resize(img, None, fx=scale/img_scale, fy=scale/img_scale,
+                interpolation=cv2.INTER_AREA)
+        else:
+            img = np.ascontiguousarray(img)
+        return [scale_rect(r, scale, dx, dy) for r in self.detector(img, self.upsample)]
+
+    def _roi(self, box, width, height):
+        mx = int(box.width()*self.roi_margin)
+        my = int(box.height()*self.roi_margin)
+        return (max(0, box.left()-mx), max(0, box.top()-my),
+            min(width, box.right()+mx+1), min(height, box.bottom()+my+1))
+
+    def detect(self, img, priors=None, reduced=None):
+        """Return the face boxes in full resolution coordinates"""
+        self.since_full_scan += 1
+        if self.roi_search and priors and \
+                self.since_full_scan < self.full_scan_interval:
+            if callable(img):
+                img = img()
+            height, width = img.shape[:2]
+            boxes = []
+            for prior in priors:
+                left, top, right, bottom = self._roi(prior, width, height)
+                for box in self._detect(img[top:bottom, left:right], left, top):
+                    if all(overlap(box, b) < 0.5 for b in boxes):
+                        boxes.append(box)
+            if len(boxes) >= len(priors):
+                return boxes
+            logger.debug("Face lost in ROI search, scanning the whole frame")
+        self.since_full_scan = 0
+        if reduced is not None and reduced[1] >= self.scale:
+            return self._detect(reduced[0], img_scale=reduced[1])
+        if callable(img):
+            img = img()
+        return self._detect(img)
+
+    def largest(self, img, priors=None, reduced=None):
+        boxes = self.detect(img, priors, reduced)
+        if not boxes:
+            return None
+        return max(boxes, key=lambda rect: rect.width() * rect.height())
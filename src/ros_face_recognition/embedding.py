@@ -0,0 +1,90 @@
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd.
+"""Embedding backends turning aligned RGB faces into 128-d representations
+
+Every backend has forward(rgbImg) for one face and forward_batch(faces)
+for an NxHxWx3 batch, returning an (N, 128) float32 matrix.
+
+    torch   openface.TorchNeuralNet, a Lua/Torch subprocess that is sent
+            one face per call through a temporary file and a pipe
+    opencv  the same Torch model loaded in process with OpenCV's DNN
+            module, a batch is a single forward pass
+"""
+import logging
+import threading
+import cv2
+import numpy as np
+import openface
+
+logger = logging.getLogger('hr.vision.ros_face_recognition.embedding')
+
+class TorchEmbedder(object):
+    """openface.TorchNeuralNet behind the batch interface
+
+    Requests and replies share the pipe of one Lua process, so calls from
+    several threads are serialized.
+    """
+
+    name = 'torch'
+
+    def __init__(self, network_model, img_dim=96):
+        self.net = openface.TorchNeuralNet(network_model, img_dim)
+        self._lock = threading.Lock()
+
+    def forward(self, rgbImg):
+        with self._lock:
+            return np.asarray(self.net.forward(rgbImg), dtype=np.float32)
+
+    def forward_batch(self, faces):
+        reps = np.empty((len(faces), 128), dtype=np.float32)
+        with self._lock:
+            for i, face in enumerate(faces):
+                reps[i] = self.net.forward(face)
+        return reps
+
+class OpenCVEmbedder(object):
+    """The Torch model run in process by cv2.dnn
+
+    The network scales the faces to [0, 1] like the Lua script of
+    openface does. A cv2.dnn.Net is not safe to use from several threads,
+    so forward passes of the pipeline workers are serialized.
+    """
+
+    name = 'opencv'
+
+    def __init__(self, network_model, img_dim=96):
+        self.net = cv2.dnn.readNetFromTorch(network_model)
+        self.img_dim = img_dim
+        self._lock = threading.Lock()
+
+    def forward(self, rgbImg):
+        return self.forward_batch([rgbImg])[0]
+
+    def forward_batch(self, faces):
+        if len(faces) == 0:
+            return np.empty((0, 128), dtype=np.float32)
+        # The faces are RGB already, so the channels are not swapped
+        blob = cv2.dnn.blobFromImages(list(faces), 1.0/255,
+            (self.img_dim, self.img_dim), (0, 0, 0), False, False)
+        with self._lock:
+            self.net.setInput(blob)
+            reps = self.net.forward()
+        return reps.reshape(len(faces), -1).astype(np.float32, copy=False)
+
+EMBEDDERS = {
+    'torch': TorchEmbedder,
+    'opencv': OpenCVEmbedder,
+}
+
+def create_embedder(backend, network_model, img_dim=96):
+    """Load the network with a backend of EMBEDDERS. The opencv backend
+    falls back to torch if this OpenCV cannot load the model."""
+    if backend not in EMBEDDERS:
+        raise ValueError("Unknown embedding backend {}".format(backend))
+    if backend == 'opencv':
+        try:
+            return OpenCVEmbedder(network_model, img_dim)
+        except (AttributeError, cv2.error) as ex:
+            logger.warn("OpenCV cannot load {}, using Torch".format(network_model))
+            logger.warn(ex)
+            return TorchEmbedder(network_model, img_dim)
+    return EMBEDDERS[backend](network_model, img_dim)
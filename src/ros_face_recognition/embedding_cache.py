@@ -0,0 +1,112 @@
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd.
+import os
+import hashlib
+import logging
+import pickle
+
+logger = logging.getLogger('hr.vision.ros_face_recognition.embedding_cache')
+
+CACHE_VERSION = 1
+
+def model_identity(model, backend=None):
+    """Identify a network model by its file name, size and modification
+    time, and the backend running it"""
+    if not os.path.isfile(model):
+        identity = os.path.basename(model)
+    else:
+        st = os.stat(model)
+        identity = '{}:{}:{}'.format(os.path.basename(model), st.st_size,
+            int(st.st_mtime))
+    if backend is not None:
+        identity = '{}:{}'.format(identity, backend)
+    return identity
+
+def file_digest(fname):
+    with open(fname, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+class EmbeddingCache(object):
+    """Persistent store of face representations keyed by image content
+
+    Entries are keyed by the SHA1 of the aligned image and are only valid
+    for the network model and the embedding backend they were computed
+    with. A path index keeps the
+    size and mtime of every file seen, so unchanged files are not hashed
+    again.
+    """
+
+    def __init__(self, fname, model, backend=None):
+        self.fname = fname
+        self.model_id = model_identity(model, backend)
+        self.reps = {}  # digest -> rep
+        self.paths = {}  # path -> (size, mtime, digest)
+        self.seen = set()
+        self.hits = 0
+        self.misses = 0
+        self.load()
+
+    def load(self):
+        if not os.path.isfile(self.fname):
+            return
+        try:
+            with open(self.fname, 'rb') as f:
+                data = pickle.load(f)
+        except Exception as ex:
+            logger.error("Loading embedding cache {} failed".format(self.fname))
+            logger.error(ex)
+            return
+        if data.get('version') != CACHE_VERSION or \
+                data.get('model') != self.model_id:
+            logger.warn("Embedding cache {} is for another model. Discarded.".format(
+                self.fname))
+            return
+        self.reps = data['reps']
+        self.paths = data['paths']
+        logger.info("Loaded {} cached embeddings".format(len(self.reps)))
+
+    def save(self):
+        tmp_fname = self.fname + '.tmp'
+        with open(tmp_fname, 'wb') as f:
+            pickle.dump({
+                'version': CACHE_VERSION,
+                'model': self.model_id,
+                'reps': self.reps,
+                'paths': self.paths,
+            }, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_fname, self.fname)
+
+    def digest(self, path):
+        st = os.stat(path)
+        entry = self.paths.get(path)
+        if entry is not None and entry[0] == st.st_size and entry[1] == st.st_mtime:
+            digest = entry[2]
+        else:
+            digest = file_digest(path)
+            self.paths[path] = (st.st_size, st.st_mtime, digest)
+        self.seen.add(path)
+        return digest
+
+    def get(self, path):
+        """Return (digest, rep) of the image, rep is None when not cached"""
+        digest = self.digest(path)
+        rep = self.reps.get(digest)
+        if rep is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return digest, rep
+
+    def put(self, digest, rep):
+        self.reps[digest] = rep
+
+    def prune(self):
+        """Evict entries of files that were not seen since the last prune"""
+        for path in set(self.paths) - self.seen:
+            del self.paths[path]
+        live = set(entry[2] for entry in self.paths.values())
+        for digest in set(self.reps) - live:
+            del self.reps[digest]
+        logger.info("Embedding cache hits {}, misses {}, entries {}".format(
+            self.hits, self.misses, len(self.reps)))
+        self.seen = set()
+        self.hits = self.misses = 0
@@ -0,0 +1,241 @@
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd.
+import time
+import heapq
+import logging
+import itertools
+import threading
+import multiprocessing
+import numpy as np
+from ros_face_recognition.embedding import create_embedder
+
+logger = logging.getLogger('hr.vision.ros_face_recognition.embedding_pool')
+
+# Request priorities, lower is served first
+LIVE = 0
+BULK = 1
+
+def _serve(conn, backend, network_model, img_dim):
+    """Worker process: load a network and embed the batches sent to it"""
+    try:
+        net = create_embedder(backend, network_model, img_dim)
+    except Exception as ex:
+        conn.send((False, str(ex)))
+        return
+    conn.send((True, net.name))
+    while True:
+        faces = conn.recv()
+        if faces is None:
+            break
+        try:
+            conn.send((True, net.forward_batch(faces)))
+        except Exception as ex:
+            conn.send((False, str(ex)))
+
+class _Job(object):
+    __slots__ = ('faces', 'reps', 'error', 'done')
+
+    def __init__(self, faces):
+        self.faces = faces
+        self.reps = None
+        self.error = None
+        self.done = threading.Event()
+
+    def finish(self, reps=None, error=None):
+        self.reps, self.error = reps, error
+        self.faces = None
+        self.done.set()
+
+class EmbeddingRequest(object):
+    """Pending representations of a batch submitted to the pool"""
+
+    def __init__(self, jobs):
+        self.jobs = jobs
+
+    def result(self):
+        """(N, 128) representations, raises RuntimeError if a worker failed"""
+        for job in self.jobs:
+            job.done.wait()
+            if job.error is not None:
+                raise RuntimeError("Embedding failed: {}".format(job.error))
+        if not self.jobs:
+            return np.empty((0, 128), dtype=np.float32)
+        if len(self.jobs) == 1:
+            return self.jobs[0].reps
+        return np.vstack([job.reps for job in self.jobs])
+
+class EmbeddingPool(object):
+    """Worker processes, each with its own network, serving one priority
+    queue
+
+    A batch is split into jobs: live batches evenly over the workers, so
+    the faces of a frame are embedded in parallel, and bulk batches into
+    jobs of bulk_chunk faces. Workers always take the job of the highest
+    priority, oldest first, so a live request only waits for the bulk
+    jobs already running. The first reserved workers only take live
+    jobs. The workers are started on first use and each is fed by a
+    thread of this process over a pipe. A worker that dies is replaced
+    right away, only the job it was running fails.
+    """
+
+    def __init__(self, backend, network_model, img_dim=96, workers=2,
+                 reserved=0, bulk_chunk=16):
+        self.backend = backend
+        self.network_model = network_model
+        self.img_dim = img_dim
+        self.workers = max(1, workers)
+        self.reserved = min(reserved, self.workers - 1)
+        self.bulk_chunk = max(1, bulk_chunk)
+        self.name = '{} pool of {}'.format(backend, self.workers)
+        self._queue = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._spawn_lock = threading.Lock()
+        self._alive = 0
+        self._closed = False
+        self._busy = [0.0]*self.workers
+        self._jobs = [0]*self.workers
+        self._since = time.time()
+
+    def start(self):
+        with self._cond:
+            if self._threads or self._closed:
+                return
+            for i in range(self.workers):
+                job = threading.Thread(target=self._dispatch,
+                    args=(i,) + self._spawn(i), name='embed-dispatch-{}'.format(i))
+                job.daemon = True
+                self._threads.append(job)
+            self._alive = self.workers
+        for job in self._threads:
+            job.start()
+
+    def _spawn(self, i):
+        conn, child = multiprocessing.Pipe()
+        proc = multiprocessing.Process(target=_serve, name='embed-worker-{}'.format(i),
+            args=(child, self.backend, self.network_model, self.img_dim))
+        proc.daemon = True
+        with self._spawn_lock:
+            proc.start()
+        child.close()
+        return conn, proc
+
+    def _wait_ready(self, i, conn, proc):
+        """Wait until the worker has loaded its network"""
+        try:
+            ok, result = conn.recv()
+        except (EOFError, IOError) as ex:
+            ok, result = False, ex
+        if not ok:
+            logger.error("Embedding worker {} failed to start: {}".format(i, result))
+            proc.join()
+            return None, None
+        logger.info("Embedding worker {} ready with {}".format(i, result))
+        return conn, proc
+
+    def _take(self, i):
+        """The next job worker i may run, None when closed"""
+        with self._cond:
+            while not self._closed:
+                if self._queue and (i >= self.reserved or self._queue[0][0] == LIVE):
+                    return heapq.heappop(self._queue)[2]
+                self._cond.wait()
+            return None
+
+    def _dispatch(self, i, conn, proc):
+        conn, proc = self._wait_ready(i, conn, proc)
+        while conn is not None:
+            job = self._take(i)
+            if job is None:
+                try:
+                    conn.send(None)
+                except IOError:
+                    pass
+                break
+            start = time.time()
+            died = False
+            try:
+                conn.send(job.faces)
+                ok, result = conn.recv()
+            except (EOFError, IOError) as ex:
+                ok, result = False, 'worker {} died: {}'.format(i, ex)
+                died = True
+            if ok:
+                job.finish(reps=result)
+            else:
+                job.finish(error=result)
+            with self._cond:
+                self._busy[i] += time.time() - start
+                self._jobs[i] += 1
+            if died:
+                logger.error("Embedding worker {} died, restarting".format(i))
+                conn.close()
+                proc.join(1)
+                conn, proc = self._wait_ready(i, *self._spawn(i))
+        if proc is not None:
+            proc.join(1)
+        with self._cond:
+            self._alive -= 1
+            if self._alive == 0:
+                # No worker is left to serve the queue
+                self._fail_queued('no embedding worker is running')
+
+    def _fail_queued(self, error):
+        self._closed = True
+        for _, _, job in self._queue:
+            job.finish(error=error)
+        self._queue = []
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def submit(self, faces, priority=LIVE):
+        """Queue an NxHxWx3 batch of aligned RGB faces"""
+        self.start()
+        n = len(faces)
+        if priority == LIVE:
+            size = max(1, -(-n//self.workers))
+        else:
+            size = self.bulk_chunk
+        jobs = [_Job(faces[i:i+size]) for i in range(0, n, size)]
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Embedding pool is closed")
+            for job in jobs:
+                heapq.heappush(self._queue, (priority, next(self._seq), job))
+            self._cond.notify_all()
+        return EmbeddingRequest(jobs)
+
+    def forward_batch(self, faces, priority=LIVE):
+        return self.submit(faces, priority).result()
+
+    def forward(self, rgbImg, priority=LIVE):
+        return self.forward_batch([rgbImg], priority)[0]
+
+    def stats(self, reset=False):
+        """Queue depth per priority and the share of time each worker
+        was busy since the last reset"""
+        with self._cond:
+            now = time.time()
+            elapsed = max(now - self._since, 1e-6)
+            priorities = [entry[0] for entry in self._queue]
+            stats = {
+                'workers': self._alive,
+                'queue live': priorities.count(LIVE),
+                'queue bulk': len(priorities) - priorities.count(LIVE),
+                'jobs': sum(self._jobs),
+                'utilization': [round(busy/elapsed, 3) for busy in self._busy],
+            }
+            if reset:
+                self._busy = [0.0]*self.workers
+                self._jobs = [0]*self.workers
+                self._since = now
+            return stats
+
+    def close(self):
+        with self._cond:
+            self._fail_queued('embedding pool is closed')
+            self._cond.notify_all()
+        for job in self._threads:
+            job.join(1)
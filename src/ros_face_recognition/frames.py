@@ -0,0 +1,177 @@
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd.
+import logging
+import threading
+import cv2
+import numpy as np
+from ros_face_recognition.profiling import StageProfiler
+
+logger = logging.getLogger('hr.vision.ros_face_recognition.frames')
+
+# Reduced resolution decoding of compressed frames, by the reduction factor
+REDUCED_COLOR = [(8, cv2.IMREAD_REDUCED_COLOR_8),
+                 (4, cv2.IMREAD_REDUCED_COLOR_4),
+                 (2, cv2.IMREAD_REDUCED_COLOR_2)]
+
+class BufferPool(object):
+    """Image buffers handed back by released frames, for the next frames
+    of the same size. A frame only allocates a buffer when every buffer
+    of the size is in use, e.g. by frames processed in parallel."""
+
+    def __init__(self, max_free=4):
+        self.max_free = max_free
+        self._free = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, shape, dtype=np.uint8):
+        """A free buffer of the shape, or None"""
+        with self._lock:
+            free = self._free.get((tuple(shape), np.dtype(dtype).str))
+            if free:
+                return free.pop()
+
+    def release(self, buf):
+        with self._lock:
+            free = self._free.setdefault((buf.shape, buf.dtype.str), [])
+            if len(free) < self.max_free:
+                free.append(buf)
+
+class Frame(object):
+    """A camera frame decoded at most once per colorspace
+
+    The frame wraps a sensor_msgs Image or CompressedImage message or a BGR
+    image. Raw messages are decoded into pooled buffers on first access of
+    bgr or rgb, the other colorspace is converted into another pooled
+    buffer only when it is asked for. Compressed messages can also be
+    decoded at a reduced resolution, see reduced(). release() hands the
+    buffers back to the pool, the images must not be used after that.
+    Decodes, conversions, copies and allocations are counted in the
+    profiler.
+    """
+
+    def __init__(self, msg=None, image=None, pool=None, bridge=None, profiler=None):
+        self.msg = msg
+        self.pool = pool or BufferPool()
+        self.bridge = bridge
+        self.profiler = profiler or StageProfiler()
+        self.compressed = msg is not None and hasattr(msg, 'format')
+        self._images = {}
+        self._reduced = {}
+        self._pooled = []
+        if image is not None:
+            self._images['bgr'] = image
+
+    @property
+    def header(self):
+        return self.msg.header if self.msg is not None else None
+
+    @property
+    def decoded(self):
+        return bool(self._images)
+
+    def _buffer(self, shape):
+        buf = self.pool.acquire(shape)
+        if buf is None:
+            self.profiler.count('frame buffers allocated')
+            buf = np.empty(shape, dtype=np.uint8)
+        self._pooled.append(buf)
+        return buf
+
+    def _decode(self):
+        with self.profiler.stage('decode'):
+            self._decode_msg()
+
+    def _decode_msg(self):
+        msg = self.msg
+        self.profiler.count('frame decodes')
+        if self.compressed:
+            # imdecode cannot write into an existing buffer
+            self.profiler.count('frame buffers allocated')
+            self._images['bgr'] = cv2.imdecode(
+                np.frombuffer(msg.data, dtype=np.uint8), cv2.IMREAD_COLOR)
+            return
+        encoding = msg.encoding
+        if encoding in ('bgr8', 'rgb8', 'mono8'):
+            channels = 1 if encoding == 'mono8' else 3
+            data = np.frombuffer(msg.data, dtype=np.uint8).reshape(msg.height, msg.step)
+            data = data[:, :msg.width*channels]
+            if channels == 1:
+                buf = self._buffer((msg.height, msg.width, 3))
+                cv2.cvtColor(data, cv2.COLOR_GRAY2BGR, dst=buf)
+                self._images['bgr'] = buf
+            else:
+                buf = self._buffer((msg.height, msg.width, 3))
+                np.copyto(buf, data.reshape(msg.height, msg.width, 3))
+                self._images[encoding[:3]] = buf
+        else:
+            self.profiler.count('frame buffers allocated')
+            self._images['bgr'] = self.bridge.imgmsg_to_cv2(msg, 'bgr8')
+
+    def _get(self, colorspace):
+        image = self._images.get(colorspace)
+        if image is not None:
+            return image
+        if not self._images:
+            self._decode()
+            image = self._images.get(colorspace)
+            if image is not None:
+                return image
+        other = self._images['rgb' if colorspace == 'bgr' else 'bgr']
+        buf = self._buffer(other.shape)
+        self.profiler.count('frame conversions')
+        with self.profiler.stage('rgb'):
+            cv2.cvtColor(other, cv2.COLOR_BGR2RGB, dst=buf)
+        self._images[colorspace] = buf
+        return buf
+
+    @property
+    def bgr(self):
+        return self._get('bgr')
+
+    @property
+    def rgb(self):
+        return self._get('rgb')
+
+    def reduced(self, scale, rgb=False):
+        """(image, actual scale) of a compressed frame decoded at no less
+        than scale times its resolution, or None when that would not be
+        cheaper than the full frame, i.e. for raw messages, for frames
+        already decoded and for scales above 1/2"""
+        if not self.compressed or self._images or scale > 0.5:
+            return None
+        for factor, flag in REDUCED_COLOR:
+            if 1.0/factor >= scale:
+                break
+        key = (factor, rgb)
+        if key not in self._reduced:
+            bgr = self._reduced.get((factor, False))
+            if bgr is None:
+                self.profiler.count('frame decodes reduced')
+                self.profiler.count('frame buffers allocated')
+                with self.profiler.stage('decode'):
+                    bgr = cv2.imdecode(np.frombuffer(self.msg.data, dtype=np.uint8), flag)
+                self._reduced[(factor, False)] = bgr
+            if rgb:
+                self.profiler.count('frame conversions')
+                self.profiler.count('frame buffers allocated')
+                self._reduced[key] = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+        return self._reduced[key], 1.0/factor
+
+    def preview(self, scale):
+        """The frame at no less than scale times its resolution, decoding
+        as little of a compressed frame as possible"""
+        reduced = self.reduced(scale)
+        if reduced is not None:
+            return reduced[0]
+        return self.bgr
+
+    def copy(self):
+        """A BGR copy that stays valid after release()"""
+        self.profiler.count('frame copies')
+        return self.bgr.copy()
+
+    def release(self):
+        for buf in self._pooled:
+            self.pool.release(buf)
+        self._pooled = []
+        self._images = {}
+        self._reduced = {}
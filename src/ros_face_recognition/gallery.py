@@ -0,0 +1,88 @@
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd.
+import logging
+import numpy as np
+
+logger = logging.getLogger('hr.vision.ros_face_recognition.gallery')
+
+def kmeans(X, k, iterations=10, sample=20000, random_state=0):
+    """Plain Lloyd's k-means on a sample of X, returns the centroids"""
+    rng = np.random.RandomState(random_state)
+    if len(X) > sample:
+        X = X[np.sort(rng.choice(len(X), sample, replace=False))]
+    centroids = X[rng.choice(len(X), k, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(np.dot(X, centroids.T) -
+            0.5*(centroids**2).sum(axis=1), axis=1)
+        for i in range(k):
+            members = X[assign == i]
+            if len(members):
+                centroids[i] = members.mean(axis=0)
+    return centroids
+
+class GalleryIndex(object):
+    """Nearest neighbour search over enrolled face representations
+
+    Distances are squared L2 like openface's compare script, a query
+    farther than the threshold from every enrolled face is unknown.
+    The exact mode is one matrix product per batch of queries. The
+    approximate mode partitions the gallery into k-means cells and only
+    scans the nprobe cells closest to the query.
+    """
+
+    def __init__(self, reps, labels, approximate=False, nlist=None, nprobe=8):
+        self.reps = np.ascontiguousarray(reps, dtype=np.float32)
+        self.labels = np.asarray(labels, dtype=object)
+        self.sqnorms = (self.reps**2).sum(axis=1)
+        self.approximate = approximate and len(self.reps) > 1000
+        self.nprobe = nprobe
+        if self.approximate:
+            nlist = nlist or int(np.sqrt(len(self.reps)))
+            self.centroids = kmeans(self.reps, nlist)
+            assign = self._nearest_cells(self.reps, 1)[:, 0]
+            order = np.argsort(assign, kind='mergesort')
+            bounds = np.searchsorted(assign[order], np.arange(nlist+1))
+            self.cells = [order[bounds[i]:bounds[i+1]] for i in range(nlist)]
+        logger.info("Built {} gallery index of {} faces".format(
+            'approximate' if self.approximate else 'exact', len(self.reps)))
+
+    def __len__(self):
+        return len(self.reps)
+
+    def _nearest_cells(self, X, n):
+        d = (self.centroids**2).sum(axis=1) - 2*np.dot(X, self.centroids.T)
+        if n >= d.shape[1]:
+            return np.argsort(d, axis=1)
+        return np.argpartition(d, n, axis=1)[:, :n]
+
+    def _distances(self, q, ids=None):
+        reps = self.reps if ids is None else self.reps[ids]
+        sqnorms = self.sqnorms if ids is None else self.sqnorms[ids]
+        return np.maximum(sqnorms - 2*np.dot(q, reps.T) + (q**2).sum(axis=-1, keepdims=True), 0)
+
+    def search(self, queries):
+        """Return the nearest enrolled label and squared distance of each query"""
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.reps.shape[1])
+        if len(self.reps) == 0:
+            return np.array([None]*len(queries), dtype=object), np.full(len(queries), np.inf)
+        if not self.approximate:
+            d = self._distances(queries)
+            nearest = np.argmin(d, axis=1)
+            return self.labels[nearest], d[np.arange(len(queries)), nearest]
+        labels = np.empty(len(queries), dtype=object)
+        distances = np.empty(len(queries))
+        probes = self._nearest_cells(queries, self.nprobe)
+        for i, q in enumerate(queries):
+            ids = np.concatenate([self.cells[c] for c in probes[i]])
+            if len(ids) == 0:
+                labels[i], distances[i] = None, np.inf
+                continue
+            d = self._distances(q.reshape(1, -1), ids)[0]
+            j = np.argmin(d)
+            labels[i], distances[i] = self.labels[ids[j]], d[j]
+        return labels, distances
+
+    def match(self, queries, threshold):
+        """Like search but with None for the faces farther than threshold"""
+        labels, distances = self.search(queries)
+        labels[distances > threshold] = None
+        return labels, distances
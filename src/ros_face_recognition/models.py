@@ -0,0 +1,52 @@
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd.
+import time
+import logging
+import threading
+import openface
+from ros_face_recognition.embedding import create_embedder
+
+logger = logging.getLogger('hr.vision.ros_face_recognition.models')
+
+class Models(object):
+    """The dlib and Torch models of the recognizer
+
+    The landmark predictor is loaded once, by the aligner, and is shared
+    as face_pose_predictor. The Torch network is loaded on first use by
+    the embedding backend, so it can be loaded in the background while
+    the node comes up.
+    """
+
+    def __init__(self, predictor_model, network_model, img_dim=96,
+                 embedding_backend='opencv'):
+        self.predictor_model = predictor_model
+        self.network_model = network_model
+        self.img_dim = img_dim
+        self.embedding_backend = embedding_backend
+        self._align = None
+        self._net = None
+        self._lock = threading.Lock()
+
+    @property
+    def align(self):
+        with self._lock:
+            if self._align is None:
+                start = time.time()
+                self._align = openface.AlignDlib(self.predictor_model)
+                logger.info("Loaded {} in {:.2f}s".format(
+                    self.predictor_model, time.time() - start))
+            return self._align
+
+    @property
+    def face_pose_predictor(self):
+        return self.align.predictor
+
+    @property
+    def net(self):
+        with self._lock:
+            if self._net is None:
+                start = time.time()
+                self._net = create_embedder(self.embedding_backend,
+                    self.network_model, self.img_dim)
+                logger.info("Loaded network {} with {} in {:.2f}s".format(
+                    self.network_model, self._net.name, time.time() - start))
+            return self._net
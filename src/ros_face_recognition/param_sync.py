@@ -0,0 +1,63 @@
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd.
+import time
+import logging
+import threading
+import rospy
+
+logger = logging.getLogger('hr.vision.ros_face_recognition.param_sync')
+
+class ParamSync(object):
+    """Mirror values to the parameter server from a background thread
+
+    set() only records the value. The thread writes the values that
+    changed since they were last written, at most once every
+    min_interval seconds, so callers never wait on the ROS master.
+    """
+
+    def __init__(self, namespace, min_interval=1.0, set_param=rospy.set_param):
+        self.namespace = namespace
+        self.min_interval = min_interval
+        self.set_param = set_param
+        self._cond = threading.Condition()
+        self._pending = {}
+        self._written = {}
+        self._last_write = 0
+        self._stopped = False
+        self._job = threading.Thread(target=self._run, name='param-sync')
+        self._job.daemon = True
+        self._job.start()
+
+    def set(self, key, value):
+        with self._cond:
+            if key not in self._pending and self._written.get(key) == value:
+                return
+            self._pending[key] = value
+            self._cond.notify()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._job.join(1)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopped:
+                    self._cond.wait(1)
+                if self._stopped:
+                    return
+                delay = self._last_write + self.min_interval - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            with self._cond:
+                pending, self._pending = self._pending, {}
+            for key, value in pending.items():
+                if self._written.get(key) == value:
+                    continue
+                try:
+                    self.set_param('{}/{}'.format(self.namespace, key), value)
+                    self._written[key] = value
+                except Exception as ex:
+                    logger.error("Setting parameter {} failed: {}".format(key, ex))
+            self._last_write = time.time()
@@ -0,0 +1,208 @@
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd.
+import time
+import logging
+import threading
+
+logger = logging.getLogger('hr.vision.ros_face_recognition.pipeline')
+
+class LatestFrameSlot(object):
+    """Single slot holding only the newest frame, older frames are dropped"""
+
+    def __init__(self, cond=None):
+        self._cond = cond or threading.Condition()
+        self._frame = None
+        self._stamp = None
+        self._closed = False
+        self.received = 0
+        self.dropped = 0
+        self.processed = 0
+        self.total_age = 0.0
+        self.max_age = 0.0
+        self.total_latency = 0.0
+
+    def put(self, frame):
+        with self._cond:
+            if self._frame is not None:
+                self.dropped += 1
+            self._frame = frame
+            self._stamp = time.time()
+            self.received += 1
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """Return the newest frame and its age in the slot in seconds.
+        Returns (None, None) on timeout or when the slot is closed."""
+        with self._cond:
+            if self._frame is None and not self._closed:
+                self._cond.wait(timeout)
+            if self._frame is None:
+                return None, None
+            frame, age = self._frame, time.time() - self._stamp
+            self._frame, self._stamp = None, None
+            self.processed += 1
+            self.total_age += age
+            self.max_age = max(self.max_age, age)
+            return frame, age
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    @property
+    def pending(self):
+        return self._frame is not None
+
+    def done(self, latency):
+        """Record the end-to-end latency (queue age + processing) of a frame"""
+        with self._cond:
+            self.total_latency += latency
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def stats(self, reset=False):
+        with self._cond:
+            stats = {
+                'received': self.received,
+                'dropped': self.dropped,
+                'processed': self.processed,
+                'mean_age': self.total_age/self.processed if self.processed else 0.0,
+                'max_age': self.max_age,
+                'mean_latency': self.total_latency/self.processed if self.processed else 0.0,
+            }
+            if reset:
+                self.received = self.dropped = self.processed = 0
+                self.total_age = self.max_age = self.total_latency = 0.0
+            return stats
+
+class FairScheduler(object):
+    """Newest frame of each source, handed out round-robin
+
+    Every source has its own LatestFrameSlot. A worker takes the frame of
+    the next source in turn that has one, so a fast camera cannot starve
+    the others. A source is processed by at most one worker at a time,
+    its newest frame waits in the slot until the frame before it is done,
+    so the frames of a source are handled in order.
+    """
+
+    def __init__(self, sources):
+        self._cond = threading.Condition()
+        self.sources = list(sources)
+        self.slots = dict((source, LatestFrameSlot(self._cond))
+            for source in self.sources)
+        self._next = 0
+        self._busy = dict((source, 0) for source in self.sources)
+        self._closed = False
+
+    def put(self, source, frame):
+        self.slots[source].put(frame)
+
+    def _take(self):
+        n = len(self.sources)
+        for i in range(n):
+            source = self.sources[(self._next + i) % n]
+            if self.slots[source].pending and not self._busy[source]:
+                self._next = (self._next + i + 1) % n
+                self._busy[source] += 1
+                frame, age = self.slots[source].get()
+                return source, frame, age
+        return None
+
+    def get(self, timeout=None):
+        """Return (source, frame, age), or (None, None, None) on timeout
+        or when closed. done() must be called when the frame is processed."""
+        with self._cond:
+            deadline = None if timeout is None else time.time() + timeout
+            while not self._closed:
+                job = self._take()
+                if job is not None:
+                    return job
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return None, None, None
+
+    def done(self, source, latency):
+        with self._cond:
+            self._busy[source] -= 1
+            self.slots[source].done(latency)
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            for slot in self.slots.values():
+                slot.close()
+
+    @property
+    def closed(self):
+        return self._closed
+
+class FramePipeline(object):
+    """Worker threads pulling the newest frame of each source from a
+    FairScheduler
+
+    The subscriber callback only calls put(), so it never waits on
+    inference. Frames arriving while all workers are busy replace each
+    other in the slot of their source and only the most recent one is
+    processed. The handler is called with the frame and its source.
+    """
+
+    def __init__(self, handler, workers=1, report_interval=10, sources=(None,)):
+        self.handler = handler
+        self.scheduler = FairScheduler(sources)
+        self.slots = self.scheduler.slots
+        self.report_interval = report_interval
+        self._threads = []
+        for i in range(max(1, workers)):
+            job = threading.Thread(target=self._run, name='face-worker-{}'.format(i))
+            job.daemon = True
+            self._threads.append(job)
+        self._last_report = time.time()
+        self._report_lock = threading.Lock()
+
+    def start(self):
+        for job in self._threads:
+            job.start()
+        logger.info("Started {} inference workers".format(len(self._threads)))
+
+    def stop(self):
+        self.scheduler.close()
+        for job in self._threads:
+            job.join(1)
+
+    def put(self, frame, source=None):
+        self.scheduler.put(source, frame)
+
+    def _run(self):
+        while not self.scheduler.closed:
+            source, frame, age = self.scheduler.get(timeout=0.5)
+            if frame is None:
+                continue
+            start = time.time()
+            try:
+                self.handler(frame, source)
+            except Exception as ex:
+                logger.error("Processing frame failed")
+                logger.error(ex)
+            self.scheduler.done(source, age + time.time() - start)
+            self._report()
+
+    def _report(self):
+        if self.report_interval <= 0:
+            return
+        with self._report_lock:
+            now = time.time()
+            if now - self._last_report < self.report_interval:
+                return
+            self._last_report = now
+        for source in self.scheduler.sources:
+            stats = self.slots[source].stats(reset=True)
+            logger.info(
+                "{source}Frames received {received}, processed {processed}, "
+                "dropped {dropped}, queue age mean {mean_age:.3f}s max {max_age:.3f}s, "
+                "latency mean {mean_latency:.3f}s".format(
+                    source='' if source is None else '[{}] '.format(source), **stats))
@@ -0,0 +1,93 @@
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd.
+import json
+import time
+import logging
+import threading
+import numpy as np
+
+logger = logging.getLogger('hr.vision.ros_face_recognition.profiling')
+
+class StageStats(object):
+    """Rolling window of the latest durations of a stage"""
+
+    def __init__(self, window):
+        self.samples = np.zeros(window)
+        self.index = 0
+        self.count = 0
+
+    def add(self, seconds):
+        self.samples[self.index] = seconds
+        self.index = (self.index + 1) % len(self.samples)
+        self.count += 1
+
+    def summary(self):
+        samples = self.samples[:min(self.count, len(self.samples))]*1000
+        p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+        return {
+            'count': self.count,
+            'mean_ms': float(samples.mean()),
+            'p50_ms': float(p50),
+            'p95_ms': float(p95),
+            'p99_ms': float(p99),
+            'max_ms': float(samples.max()),
+        }
+
+class _Timer(object):
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *args):
+        self.profiler.record(self.name, time.time() - self.start)
+
+class StageProfiler(object):
+    """Per-stage latency percentiles over a rolling window
+
+    Recording a sample is a single array store, so profiling can stay on
+    in production. Percentiles are only computed in summary().
+
+        with profiler.stage('detect'):
+            ...
+    """
+
+    def __init__(self, window=1024):
+        self.window = window
+        self.stages = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def stage(self, name):
+        return _Timer(self, name)
+
+    def record(self, name, seconds):
+        with self._lock:
+            stats = self.stages.get(name)
+            if stats is None:
+                stats = self.stages[name] = StageStats(self.window)
+            stats.add(seconds)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def summary(self):
+        with self._lock:
+            stages = dict((name, stats.summary())
+                for name, stats in self.stages.items() if stats.count)
+            return {'stages': stages, 'counters': dict(self.counters)}
+
+    def dump(self, fname):
+        with open(fname, 'w') as f:
+            json.dump(self.summary(), f, indent=2, sort_keys=True)
+        logger.info("Profile is dumped to {}".format(fname))
+
+    def log(self):
+        for name, s in sorted(self.summary()['stages'].items()):
+            logger.info("{:<12} n={:<7} p50 {:8.2f}ms p95 {:8.2f}ms p99 {:8.2f}ms".format(
+                name, s['count'], s['p50_ms'], s['p95_ms'], s['p99_ms']))
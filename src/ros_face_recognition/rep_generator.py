@@ -0,0 +1,124 @@
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd.
+import os
+import cv2
+import json
+import hashlib
+import logging
+import numpy as np
+from collections import deque
+from openface.data import iterImgs
+from ros_face_recognition.embedding_pool import BULK
+
+logger = logging.getLogger('hr.vision.ros_face_recognition.rep_generator')
+
+def load_faces(paths):
+    """Aligned face images as a batch of RGB faces"""
+    return np.stack([cv2.cvtColor(cv2.imread(path), cv2.COLOR_BGR2RGB)
+        for path in paths])
+
+def path_bytes(path):
+    """The path as the bytes the file system has, str paths of Python 2
+    are bytes already"""
+    if isinstance(path, bytes):
+        return path
+    if hasattr(os, 'fsencode'):
+        return os.fsencode(path)
+    return path.encode('utf-8')
+
+def chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i+size]
+
+class RepGenerator(object):
+    """Embed a tree of aligned images into a RepStore chunk by chunk
+
+    Every chunk is appended to the store as soon as it is embedded, so
+    only one chunk of representations per worker is held in memory. A
+    checkpoint next to the store records which image list is being
+    embedded. An interrupted run of the same list resumes after the rows
+    already committed to the store. The chunks are embedded by an
+    EmbeddingPool at bulk priority.
+    """
+
+    def __init__(self, pool, chunk_size=256):
+        self.pool = pool
+        self.chunk_size = chunk_size
+
+    def checkpoint_fname(self, store):
+        return os.path.join(store.directory, '{}.gen.json'.format(store.name))
+
+    def list_images(self, aligned_dir):
+        images = sorted(iterImgs(aligned_dir), key=lambda img: img.path)
+        digest = hashlib.sha1(b'\n'.join(path_bytes(img.path) for img in images))
+        return images, digest.hexdigest()
+
+    def start(self, store, digest, n_total, resume):
+        """Return the index of the first image to embed"""
+        fname = self.checkpoint_fname(store)
+        if resume and os.path.isfile(fname):
+            with open(fname) as f:
+                checkpoint = json.load(f)
+            if checkpoint.get('digest') == digest and store.count <= n_total:
+                return store.count
+        store.clear()
+        with open(fname, 'w') as f:
+            json.dump({'digest': digest, 'total': n_total}, f)
+        return 0
+
+    def _lookup(self, batches, cache):
+        """(batch, (digest, rep) of every image, paths to embed) of each
+        batch, the cache is only looked up when the batch is reached"""
+        for batch in batches:
+            if cache is None:
+                entries = [(None, None)]*len(batch)
+            else:
+                entries = [cache.get(img.path) for img in batch]
+            yield batch, entries, [img.path for img, (_, rep)
+                in zip(batch, entries) if rep is None]
+
+    def _results(self, planned):
+        # The next chunk is queued while the previous one is stored, the
+        # results are taken in order, so the chunks are appended in order
+        pending = deque()
+        for batch, entries, paths in planned:
+            request = self.pool.submit(load_faces(paths), BULK) if paths else None
+            pending.append((batch, entries, request))
+            if len(pending) > 1:
+                yield self._result(*pending.popleft())
+        while pending:
+            yield self._result(*pending.popleft())
+
+    def _result(self, batch, entries, request):
+        return batch, entries, request.result() if request is not None else []
+
+    def run(self, aligned_dir, store, cache=None, resume=True):
+        """Embed the images under aligned_dir into store. Representations
+        found in the EmbeddingCache are not computed again."""
+        images, digest = self.list_images(aligned_dir)
+        n_total = len(images)
+        first = self.start(store, digest, n_total, resume)
+        if first:
+            logger.info("Resuming embedding, {} of {} images done".format(
+                first, n_total))
+
+        done = first
+        planned = self._lookup(chunks(images[first:], self.chunk_size), cache)
+        for batch, entries, computed in self._results(planned):
+            computed = iter(computed)
+            reps = np.empty((len(batch), store.dim), dtype=np.float32)
+            for i, (digest, rep) in enumerate(entries):
+                if rep is None:
+                    rep = next(computed)
+                    if cache is not None:
+                        cache.put(digest, rep)
+                reps[i] = rep
+            store.append(reps, [(img.cls, img.name) for img in batch])
+            done += len(batch)
+            logger.info("{}/{}".format(done, n_total))
+
+        if cache is not None:
+            if first == 0:
+                cache.prune()
+            cache.save()
+        os.remove(self.checkpoint_fname(store))
+        return n_total
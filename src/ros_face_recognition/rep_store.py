@@ -0,0 +1,181 @@
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd.
+import os
+import json
+import logging
+import itertools
+import numpy as np
+
+logger = logging.getLogger('hr.vision.ros_face_recognition.rep_store')
+
+class RepStore(object):
+    """Binary store of face representations and their labels
+
+    A store named <name> in <directory> consists of
+        <name>.f32   float32 matrix of representations, row-major
+        <name>.lbl   int32 class index of each row
+        <name>.log   append log of "class<TAB>image name" for each row
+        <name>.json  dimension, committed row count, committed size of the
+                     log and class names
+
+    Rows are appended to the data files first and committed by atomically
+    rewriting the small json header, so a torn append is ignored and cut
+    off on the next write. Loading memory-maps the matrix without copying.
+    """
+
+    def __init__(self, directory, name='reps', dim=128):
+        self.directory = directory
+        self.name = name
+        self.dim = dim
+        self.count = 0
+        self.log_size = 0
+        self.classes = []
+        self.load_meta()
+
+    def _path(self, ext):
+        return os.path.join(self.directory, '{}.{}'.format(self.name, ext))
+
+    @property
+    def meta_fname(self):
+        return self._path('json')
+
+    def exists(self):
+        return os.path.isfile(self.meta_fname)
+
+    def load_meta(self):
+        if not self.exists():
+            return
+        with open(self.meta_fname) as f:
+            meta = json.load(f)
+        self.dim = meta['dim']
+        self.count = meta['count']
+        self.classes = meta['classes']
+        # Stores written before the log size was recorded
+        self.log_size = meta.get('log_size')
+        if self.log_size is None:
+            self.log_size = self._committed_log_size()
+
+    def _committed_log_size(self):
+        fname = self._path('log')
+        if not os.path.isfile(fname):
+            return 0
+        with open(fname, 'rb') as f:
+            return sum(len(line) for line in itertools.islice(f, self.count))
+
+    def _commit(self):
+        tmp_fname = self.meta_fname + '.tmp'
+        with open(tmp_fname, 'w') as f:
+            json.dump({'dim': self.dim, 'count': self.count,
+                       'log_size': self.log_size, 'classes': self.classes}, f)
+        os.rename(tmp_fname, self.meta_fname)
+
+    def _truncate(self):
+        # Drop rows of an append that was never committed
+        sizes = [('f32', self.count*self.dim*4), ('lbl', self.count*4),
+                 ('log', self.log_size)]
+        for ext, size in sizes:
+            fname = self._path(ext)
+            if os.path.isfile(fname) and os.path.getsize(fname) > size:
+                with open(fname, 'r+b') as f:
+                    f.truncate(size)
+
+    def append(self, reps, labels):
+        """Append representations and their (class, image name) labels"""
+        reps = np.asarray(reps, dtype=np.float32).reshape(-1, self.dim)
+        if len(reps) != len(labels):
+            raise ValueError("{} representations but {} labels".format(
+                len(reps), len(labels)))
+        if len(reps) == 0:
+            return
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        self._truncate()
+        index = dict((cls, i) for i, cls in enumerate(self.classes))
+        lbl = np.empty(len(labels), dtype=np.int32)
+        for i, (cls, _) in enumerate(labels):
+            if cls not in index:
+                index[cls] = len(self.classes)
+                self.classes.append(cls)
+            lbl[i] = index[cls]
+        with open(self._path('f32'), 'ab') as f:
+            reps.tofile(f)
+        with open(self._path('lbl'), 'ab') as f:
+            lbl.tofile(f)
+        with open(self._path('log'), 'a') as f:
+            for cls, name in labels:
+                f.write('{}\t{}\n'.format(cls, name))
+        self.count += len(reps)
+        self.log_size = os.path.getsize(self._path('log'))
+        self._commit()
+
+    def write(self, reps, labels):
+        """Replace the content of the store"""
+        self.clear()
+        self.append(reps, labels)
+
+    def clear(self):
+        for ext in ['json', 'f32', 'lbl', 'log']:
+            fname = self._path(ext)
+            if os.path.isfile(fname):
+                os.remove(fname)
+        self.count = 0
+        self.log_size = 0
+        self.classes = []
+
+    def reps(self):
+        """Memory-mapped (count, dim) float32 matrix"""
+        if self.count == 0:
+            return np.empty((0, self.dim), dtype=np.float32)
+        return np.memmap(self._path('f32'), dtype=np.float32, mode='r',
+            shape=(self.count, self.dim))
+
+    def label_index(self):
+        if self.count == 0:
+            return np.empty(0, dtype=np.int32)
+        return np.memmap(self._path('lbl'), dtype=np.int32, mode='r',
+            shape=(self.count,))
+
+    def labels(self):
+        """Class name of each row"""
+        return np.asarray(self.classes, dtype=object)[self.label_index()]
+
+    def names(self):
+        """Image name of each row, read from the append log"""
+        if self.count == 0:
+            return []
+        with open(self._path('log')) as f:
+            return [line.rstrip('\n').split('\t', 1)[1]
+                for line, _ in zip(f, range(self.count))]
+
+    def load(self):
+        return self.reps(), self.labels()
+
+def migrate_csv(store, reps_fname, labels_fname):
+    """Convert reps.csv/labels.csv into the store if it is missing or older"""
+    if not os.path.isfile(reps_fname) or not os.path.isfile(labels_fname):
+        return False
+    if store.exists() and os.path.getmtime(store.meta_fname) >= max(
+            os.path.getmtime(reps_fname), os.path.getmtime(labels_fname)):
+        return False
+    import pandas as pd
+    labels = pd.read_csv(labels_fname, header=None)
+    reps = pd.read_csv(reps_fname, header=None)
+    names = labels[1] if labels.shape[1] > 1 else [''] * len(labels)
+    store.dim = reps.shape[1]
+    store.write(reps.values,
+        [(cls, name) for cls, name in zip(labels[0], names)])
+    logger.info("Migrated {} and {} to {}".format(
+        reps_fname, labels_fname, store.meta_fname))
+    return True
+
+def load_stores(stores):
+    """Concatenate the representations and labels of several stores"""
+    reps, labels = [], []
+    for store in stores:
+        if store.count:
+            reps.append(store.reps())
+            labels.append(store.labels())
+    if not reps:
+        return None, None
+    if len(reps) == 1:
+        return reps[0], labels[0]
+    return np.concatenate(reps), np.concatenate(labels)
@@ -0,0 +1,73 @@
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd.
+import logging
+import cv2
+import numpy as np
+
+logger = logging.getLogger('hr.vision.ros_face_recognition.sample_gate')
+
+# 68 point landmark indices
+LEFT_EYE = 36
+RIGHT_EYE = 45
+NOSE_TIP = 30
+
+class SampleGate(object):
+    """Decide whether a face is worth keeping as a training sample
+
+    The checks are ordered by cost: face size, sharpness (variance of the
+    Laplacian of the face resized to 96x96), pose from the landmarks, and
+    novelty of the embedding, which must be at least min_distance
+    (squared) away from every sample kept for the identity. Each check
+    returns None if the face passes, otherwise the reason it failed.
+    """
+
+    def __init__(self, min_size=60, min_sharpness=20.0, max_yaw=0.3,
+                 max_roll=0.35, min_distance=0.03):
+        self.min_size = min_size
+        self.min_sharpness = min_sharpness
+        self.max_yaw = max_yaw
+        self.max_roll = max_roll
+        self.min_distance = min_distance
+        self.reps = np.empty((0, 128), dtype=np.float32)
+
+    def reset(self, reps=None):
+        """Forget the kept samples, or start from the given ones"""
+        if reps is None or len(reps) == 0:
+            self.reps = np.empty((0, 128), dtype=np.float32)
+        else:
+            self.reps = np.array(reps, dtype=np.float32)
+
+    def check_face(self, image, box):
+        if min(box.width(), box.height()) < self.min_size:
+            return 'small'
+        height, width = image.shape[:2]
+        face = image[max(0, box.top()):min(height, box.bottom()),
+                     max(0, box.left()):min(width, box.right())]
+        if face.size == 0:
+            return 'outside'
+        if face.ndim == 3:
+            face = cv2.cvtColor(face, cv2.COLOR_BGR2GRAY)
+        face = cv2.resize(face, (96, 96), interpolation=cv2.INTER_AREA)
+        if cv2.Laplacian(face, cv2.CV_64F).var() < self.min_sharpness:
+            return 'blurry'
+
+    def check_pose(self, landmarks):
+        left, right, nose = [np.array(landmarks[i], dtype=np.float32)
+            for i in [LEFT_EYE, RIGHT_EYE, NOSE_TIP]]
+        eyes = right - left
+        eye_distance = np.linalg.norm(eyes)
+        if eye_distance == 0:
+            return 'pose'
+        # Offset of the nose from the middle of the eyes along the eye line
+        yaw = np.dot(nose - (left + right)/2, eyes)/eye_distance**2
+        roll = np.arctan2(eyes[1], eyes[0])
+        if abs(yaw) > self.max_yaw or abs(roll) > self.max_roll:
+            return 'pose'
+
+    def check_novelty(self, rep):
+        if len(self.reps):
+            d = np.sum((self.reps - rep)**2, axis=1)
+            if d.min() < self.min_distance:
+                return 'duplicate'
+
+    def add(self, rep):
+        self.reps = np.vstack([self.reps, np.asarray(rep, dtype=np.float32)])
@@ -0,0 +1,114 @@
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd.
+import os
+import time
+import logging
+import cv2
+import numpy as np
+
+logger = logging.getLogger('hr.vision.ros_face_recognition.scheduler')
+
+def cpu_time():
+    t = os.times()
+    return t[0] + t[1]
+
+class RecognitionScheduler(object):
+    """Decide when to run the next recognition
+
+    The base interval keeps recognition within max_cpu_share of one core
+    given its measured cost, and is stretched further while the whole
+    process uses more CPU than that. While the scene is stable and the
+    faces are confirmed the interval backs off up to freshness_deadline;
+    a scene change or an unconfirmed face brings it back to the base.
+    """
+
+    def __init__(self, max_cpu_share=0.5, min_interval=0.1,
+                 freshness_deadline=2.0, face_timeout=5.0, change_threshold=10.0,
+                 backoff=1.5):
+        self.max_cpu_share = max_cpu_share
+        self.min_interval = min_interval
+        self.freshness_deadline = freshness_deadline
+        self.face_timeout = face_timeout
+        self.change_threshold = change_threshold
+        self.backoff = backoff
+        self.cost = 0.0
+        self.cpu_share = 0.0
+        self.stretch = 1.0
+        self.interval = min_interval
+        self.last_run = 0.0
+        self.last_face = time.time()
+        self.thumbnail = None
+        self.change = 0.0
+        self.reason = ''
+        self.skipped = 0
+        self._cpu = (time.time(), cpu_time())
+
+    def scene_change(self, image):
+        thumbnail = cv2.resize(image, (32, 24), interpolation=cv2.INTER_AREA)
+        if thumbnail.ndim == 3:
+            thumbnail = cv2.cvtColor(thumbnail, cv2.COLOR_BGR2GRAY)
+        thumbnail = thumbnail.astype(np.float32)
+        if self.thumbnail is None:
+            return thumbnail, 255.0
+        return thumbnail, float(np.mean(np.abs(thumbnail - self.thumbnail)))
+
+    def due(self, image, unconfirmed=False):
+        """Whether the frame should be recognized. The image may be a
+        function returning it, called only once min_interval has passed"""
+        now = time.time()
+        elapsed = now - self.last_run
+        if elapsed < self.min_interval:
+            self.skipped += 1
+            return False
+        if callable(image):
+            image = image()
+        thumbnail, self.change = self.scene_change(image)
+        if self.change > self.change_threshold:
+            self.reason = 'scene change'
+            self.stretch = 1.0
+        elif unconfirmed:
+            self.reason = 'unconfirmed'
+            self.stretch = 1.0
+        else:
+            self.reason = 'stable'
+        base = max(self.min_interval, self.cost/max(self.max_cpu_share, 1e-3))
+        if self.cpu_share > self.max_cpu_share:
+            base *= self.cpu_share/self.max_cpu_share
+        self.interval = min(self.freshness_deadline, base*self.stretch)
+        if self.reason == 'stable' and elapsed < self.interval:
+            self.skipped += 1
+            return False
+        if elapsed < base:
+            self.skipped += 1
+            return False
+        if self.reason == 'stable':
+            self.stretch = min(self.stretch*self.backoff,
+                self.freshness_deadline/max(base, 1e-3))
+        self.thumbnail = thumbnail
+        self.last_run = now
+        return True
+
+    def record(self, duration, found):
+        """Record the cost of a recognition and whether it found faces"""
+        now = time.time()
+        self.cost = duration if not self.cost else 0.8*self.cost + 0.2*duration
+        if found:
+            self.last_face = now
+        wall, cpu = now - self._cpu[0], cpu_time() - self._cpu[1]
+        if wall > 1.0:
+            self.cpu_share = cpu/wall
+            self._cpu = (now, cpu_time())
+
+    def faces_expired(self):
+        return time.time() - self.last_face > self.face_timeout
+
+    def decision(self):
+        decision = {
+            'interval': round(self.interval, 3),
+            'reason': self.reason,
+            'cost': round(self.cost, 4),
+            'cpu_share': round(self.cpu_share, 3),
+            'scene_change': round(self.change, 2),
+            'skipped': self.skipped,
+        }
+        self.skipped = 0
+        return decision
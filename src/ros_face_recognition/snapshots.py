@@ -0,0 +1,165 @@
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd.
+import os
+import json
+import time
+import shutil
+import fnmatch
+import hashlib
+import logging
+import datetime as dt
+
+logger = logging.getLogger('hr.vision.ros_face_recognition.snapshots')
+
+MANIFEST_VERSION = 1
+
+def file_digest(fname):
+    sha1 = hashlib.sha1()
+    with open(fname, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+class SnapshotStore(object):
+    """Content-addressed snapshots of a directory tree
+
+        <root>/objects/<ab>/<sha1>   content of a file, stored once
+        <root>/snapshots/<id>.json   manifest, {path: [sha1, size, mtime]}
+
+    A snapshot only copies content that is not stored yet, and files
+    whose size and mtime match the previous manifest are not read at all.
+    Restoring only rewrites the files that differ from the snapshot.
+    prune() keeps the newest snapshots and deletes the objects no kept
+    snapshot refers to.
+    """
+
+    def __init__(self, root, keep=10):
+        self.root = root
+        self.keep = keep
+        self.objects_dir = os.path.join(root, 'objects')
+        self.manifests_dir = os.path.join(root, 'snapshots')
+        for d in [self.objects_dir, self.manifests_dir]:
+            if not os.path.isdir(d):
+                os.makedirs(d)
+
+    def _object(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    def _manifest(self, snapshot_id):
+        return os.path.join(self.manifests_dir, '{}.json'.format(snapshot_id))
+
+    def list(self):
+        """Snapshot ids, oldest first"""
+        return sorted(fname[:-5] for fname in os.listdir(self.manifests_dir)
+            if fname.endswith('.json'))
+
+    def load(self, snapshot_id):
+        with open(self._manifest(snapshot_id)) as f:
+            return json.load(f)
+
+    def latest(self):
+        ids = self.list()
+        return ids[-1] if ids else None
+
+    def _walk(self, source_dir, exclude):
+        for dirpath, dirnames, filenames in os.walk(source_dir):
+            rel_dir = os.path.relpath(dirpath, source_dir)
+            if rel_dir == '.':
+                dirnames[:] = [d for d in dirnames
+                    if not any(fnmatch.fnmatch(d, p) for p in exclude)]
+                filenames = [f for f in filenames
+                    if not any(fnmatch.fnmatch(f, p) for p in exclude)]
+                rel_dir = ''
+            for fname in filenames:
+                yield os.path.join(rel_dir, fname)
+
+    def _store(self, fname, digest):
+        obj = self._object(digest)
+        if os.path.isfile(obj):
+            return False
+        if not os.path.isdir(os.path.dirname(obj)):
+            os.makedirs(os.path.dirname(obj))
+        tmp_fname = obj + '.tmp'
+        shutil.copyfile(fname, tmp_fname)
+        os.rename(tmp_fname, obj)
+        return True
+
+    def snapshot(self, source_dir, exclude=()):
+        """Snapshot the files under source_dir except the top level entries
+        matching the exclude patterns. Returns the snapshot id, which is
+        the previous one if nothing changed."""
+        start = time.time()
+        previous_id = self.latest()
+        previous = self.load(previous_id)['files'] if previous_id else {}
+        files = {}
+        stored = 0
+        for path in self._walk(source_dir, exclude):
+            fname = os.path.join(source_dir, path)
+            try:
+                st = os.stat(fname)
+                entry = previous.get(path)
+                if entry is not None and entry[1] == st.st_size and \
+                        entry[2] == st.st_mtime and os.path.isfile(self._object(entry[0])):
+                    digest = entry[0]
+                else:
+                    digest = file_digest(fname)
+                    stored += self._store(fname, digest)
+            except (IOError, OSError) as ex:
+                # The file was removed while the snapshot was taken
+                logger.warn(ex)
+                continue
+            files[path] = [digest, st.st_size, st.st_mtime]
+        if previous_id and files == previous:
+            logger.info("Nothing changed since snapshot {}".format(previous_id))
+            return previous_id
+        snapshot_id = dt.datetime.now().strftime('%Y%m%d%H%M%S-%f')
+        tmp_fname = self._manifest(snapshot_id) + '.tmp'
+        with open(tmp_fname, 'w') as f:
+            json.dump({'version': MANIFEST_VERSION, 'created': time.time(),
+                       'files': files}, f)
+        os.rename(tmp_fname, self._manifest(snapshot_id))
+        logger.info("Snapshot {} of {} files, {} new, took {:.2f}s".format(
+            snapshot_id, len(files), stored, time.time() - start))
+        return snapshot_id
+
+    def restore(self, snapshot_id, target_dir, exclude=()):
+        """Make target_dir match the snapshot, leaving the top level
+        entries matching the exclude patterns alone"""
+        start = time.time()
+        files = self.load(snapshot_id)['files']
+        for path in self._walk(target_dir, exclude):
+            if path not in files:
+                os.remove(os.path.join(target_dir, path))
+        copied = 0
+        for path, (digest, size, mtime) in files.items():
+            fname = os.path.join(target_dir, path)
+            if os.path.isfile(fname):
+                st = os.stat(fname)
+                if st.st_size == size and st.st_mtime == mtime:
+                    continue
+            if not os.path.isdir(os.path.dirname(fname)):
+                os.makedirs(os.path.dirname(fname))
+            tmp_fname = fname + '.restore'
+            shutil.copyfile(self._object(digest), tmp_fname)
+            os.utime(tmp_fname, (mtime, mtime))
+            os.rename(tmp_fname, fname)
+            copied += 1
+        logger.info("Restored snapshot {}, {} of {} files copied, took {:.2f}s".format(
+            snapshot_id, copied, len(files), time.time() - start))
+
+    def prune(self):
+        """Delete all but the newest keep snapshots and unreferenced objects"""
+        ids = self.list()
+        for snapshot_id in ids[:-self.keep] if self.keep > 0 else []:
+            os.remove(self._manifest(snapshot_id))
+            logger.info("Removed snapshot {}".format(snapshot_id))
+        live = set()
+        for snapshot_id in self.list():
+            live.update(entry[0] for entry in self.load(snapshot_id)['files'].values())
+        removed = 0
+        for dirpath, _, filenames in os.walk(self.objects_dir):
+            for digest in filenames:
+                if digest not in live:
+                    os.remove(os.path.join(dirpath, digest))
+                    removed += 1
+        if removed:
+            logger.info("Removed {} unreferenced objects".format(removed))
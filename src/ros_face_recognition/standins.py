@@ -0,0 +1,123 @@
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd.
+"""Deterministic stand-ins for the dlib and Torch models
+
+They do work of a similar shape to the real models (scan the frame,
+crop and resize faces, produce unit 128-d vectors) without model files,
+a GPU or network access, so the runtime path can be benchmarked on any
+Linux box. The results are not meaningful faces.
+"""
+import math
+import cv2
+import dlib
+import numpy as np
+
+class StandInDetector(object):
+    """Bright blob detector with the calling convention of dlib's detector"""
+
+    def __init__(self, min_size=40, max_faces=8):
+        self.min_size = min_size
+        self.max_faces = max_faces
+
+    def __call__(self, img, upsample=0):
+        if img.ndim == 3:
+            img = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+        for _ in range(upsample):
+            img = cv2.pyrUp(img)
+        scale = 2**upsample
+        img = cv2.GaussianBlur(img, (5, 5), 0)
+        _, mask = cv2.threshold(img, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        contours = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
+        rects = []
+        for contour in contours:
+            x, y, w, h = cv2.boundingRect(contour)
+            if min(w, h) >= self.min_size*scale:
+                rects.append(dlib.rectangle(x//scale, y//scale,
+                    (x+w)//scale - 1, (y+h)//scale - 1))
+        rects.sort(key=lambda r: r.area(), reverse=True)
+        return rects[:self.max_faces]
+
+class StandInPredictor(object):
+    """68 landmarks on an ellipse inside the box"""
+
+    def __call__(self, img, rect):
+        cx, cy = rect.center().x, rect.center().y
+        rx, ry = rect.width()/2.0, rect.height()/2.0
+        points = dlib.points()
+        for i in range(68):
+            a = 2*math.pi*i/68
+            points.append(dlib.point(int(cx + 0.8*rx*math.cos(a)),
+                int(cy + 0.8*ry*math.sin(a))))
+        return dlib.full_object_detection(rect, points)
+
+class StandInAlign(object):
+    """Crop and resize instead of openface.AlignDlib's affine alignment"""
+
+    def __init__(self, detector=None, predictor=None):
+        self.detector = detector or StandInDetector()
+        self.predictor = predictor or StandInPredictor()
+
+    def getAllFaceBoundingBoxes(self, rgbImg):
+        return self.detector(rgbImg, 1)
+
+    def getLargestFaceBoundingBox(self, rgbImg, skipMulti=False):
+        faces = self.getAllFaceBoundingBoxes(rgbImg)
+        if faces:
+            return max(faces, key=lambda rect: rect.width() * rect.height())
+
+    def findLandmarks(self, rgbImg, bb):
+        shape = self.predictor(rgbImg, bb)
+        return [(p.x, p.y) for p in shape.parts()]
+
+    def align(self, imgDim, rgbImg, bb=None, landmarks=None,
+              landmarkIndices=None, skipMulti=False, scale=1.0):
+        if bb is None:
+            bb = self.getLargestFaceBoundingBox(rgbImg)
+            if bb is None:
+                return None
+        if landmarks is None:
+            landmarks = self.findLandmarks(rgbImg, bb)
+        height, width = rgbImg.shape[:2]
+        crop = rgbImg[max(0, bb.top()):min(height, bb.bottom()+1),
+                      max(0, bb.left()):min(width, bb.right()+1)]
+        if crop.size == 0:
+            return None
+        return cv2.resize(crop, (imgDim, imgDim), interpolation=cv2.INTER_AREA)
+
+class StandInNet(object):
+    """Unit 128-d vector from an 8x16 grey thumbnail of the face"""
+
+    def __init__(self, imgDim=96):
+        self.imgDim = imgDim
+
+    def forward_batch(self, faces):
+        reps = np.empty((len(faces), 128), dtype=np.float32)
+        for i, face in enumerate(faces):
+            gray = cv2.cvtColor(face, cv2.COLOR_RGB2GRAY)
+            thumb = cv2.resize(gray, (16, 8), interpolation=cv2.INTER_AREA)
+            rep = thumb.astype(np.float32).ravel()
+            rep -= rep.mean()
+            reps[i] = rep/(np.linalg.norm(rep) or 1.0)
+        return reps
+
+    def forward(self, rgbImg):
+        return self.forward_batch([rgbImg])[0]
+
+class StandInModels(object):
+
+    def __init__(self, imgDim=96):
+        self.align = StandInAlign()
+        self.face_pose_predictor = self.align.predictor
+        self.net = StandInNet(imgDim)
+
+class NullPublisher(object):
+    """Publisher that only counts messages, for running without a ROS master"""
+
+    def __init__(self, subscribers=0):
+        self.subscribers = subscribers
+        self.published = 0
+
+    def get_num_connections(self):
+        return self.subscribers
+
+    def publish(self, msg):
+        self.published += 1
@@ -0,0 +1,104 @@
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd.
+import time
+import logging
+import itertools
+import dlib
+
+logger = logging.getLogger('hr.vision.ros_face_recognition.tracking')
+
+def iou(a, b):
+    inter = a.intersect(b)
+    if inter.is_empty():
+        return 0.0
+    area = float(inter.area())
+    return area/(a.area() + b.area() - area)
+
+def to_rectangle(drect):
+    return dlib.rectangle(int(round(drect.left())), int(round(drect.top())),
+        int(round(drect.right())), int(round(drect.bottom())))
+
+class Track(object):
+
+    def __init__(self, tid, image, box):
+        self.id = tid
+        self.tracker = dlib.correlation_tracker()
+        self.name = None
+        self.confidence = 0
+        self.landmarks = None
+        self.recognized = None
+        self.misses = 0
+        self.seed(image, box)
+
+    def seed(self, image, box):
+        self.tracker.start_track(image, box)
+        self.box = box
+
+    def update(self, image):
+        quality = self.tracker.update(image)
+        self.box = to_rectangle(self.tracker.get_position())
+        self.landmarks = None
+        return quality
+
+    def identify(self, name, confidence, landmarks=None):
+        self.name = name
+        self.confidence = confidence
+        self.landmarks = landmarks
+        self.recognized = time.time()
+
+class FaceTracker(object):
+    """Correlation trackers seeded from face detections
+
+    Boxes are updated on every frame by the trackers. Detections are
+    matched to tracks by overlap, and only tracks that are new, have never
+    been identified or whose identity is older than refresh seconds need
+    to be embedded again.
+    """
+
+    def __init__(self, min_quality=7.0, refresh=5.0, min_iou=0.3, max_misses=2):
+        self.min_quality = min_quality
+        self.refresh = refresh
+        self.min_iou = min_iou
+        self.max_misses = max_misses
+        self.tracks = []
+        self.lost = False
+        self._ids = itertools.count()
+
+    def update(self, image):
+        """Advance all tracks to the image, drop the ones that are lost"""
+        tracks = []
+        for track in self.tracks:
+            if track.update(image) >= self.min_quality:
+                tracks.append(track)
+            else:
+                logger.info("Lost track {} ({})".format(track.id, track.name))
+                self.lost = True
+        self.tracks = tracks
+        return tracks
+
+    def match(self, image, boxes):
+        """Reseed tracks from detections, return the tracks to be identified"""
+        now = time.time()
+        unmatched = list(self.tracks)
+        matched = []
+        for box in boxes:
+            best = max(unmatched, key=lambda t: iou(t.box, box)) if unmatched else None
+            if best is not None and iou(best.box, box) >= self.min_iou:
+                unmatched.remove(best)
+                best.seed(image, box)
+                best.misses = 0
+                matched.append(best)
+            else:
+                track = Track(next(self._ids), image, box)
+                logger.info("New track {}".format(track.id))
+                matched.append(track)
+        for track in unmatched:
+            track.misses += 1
+            if track.misses <= self.max_misses:
+                matched.append(track)
+        self.tracks = matched
+        self.lost = False
+        return [t for t in matched if t.misses == 0 and (t.recognized is None or
+            now - t.recognized > self.refresh)]
+
+    def clear(self):
+        self.tracks = []
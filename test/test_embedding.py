@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd.
+import os
+import unittest
+import numpy as np
+try:
+    from shutil import which
+except ImportError:
+    from distutils.spawn import find_executable as which
+
+try:
+    import cv2
+    from ros_face_recognition.embedding import OpenCVEmbedder, TorchEmbedder
+except ImportError:
+    cv2 = None
+
+HR_MODELS = os.environ.get('HR_MODELS', os.path.expanduser('~/.hr/cache/models'))
+NETWORK_MODEL = os.path.join(HR_MODELS, 'nn4.small2.v1.t7')
+
+# Squared distance the backends may differ by, as in bench_embedding
+TOLERANCE = 1e-4
+
+def missing():
+    """Why the backends cannot be compared here, None if they can"""
+    if cv2 is None:
+        return 'openface or OpenCV is not installed'
+    if not hasattr(cv2, 'dnn') or not hasattr(cv2.dnn, 'readNetFromTorch'):
+        return 'OpenCV cannot read Torch models'
+    if not os.path.isfile(NETWORK_MODEL):
+        return '{} is missing'.format(NETWORK_MODEL)
+    if which('th') is None:
+        return 'Lua Torch is not installed'
+
+@unittest.skipIf(missing(), missing())
+class EmbeddingEquivalenceTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.torch = TorchEmbedder(NETWORK_MODEL)
+        cls.opencv = OpenCVEmbedder(NETWORK_MODEL)
+        rng = np.random.RandomState(0)
+        cls.faces = rng.randint(0, 256, (4, 96, 96, 3)).astype(np.uint8)
+
+    def test_batch(self):
+        reference = self.torch.forward_batch(self.faces)
+        reps = self.opencv.forward_batch(self.faces)
+        self.assertEqual(reps.shape, (len(self.faces), 128))
+        self.assertLess(np.sum((reps - reference)**2, axis=1).max(), TOLERANCE)
+
+    def test_single(self):
+        reference = self.torch.forward(self.faces[0])
+        rep = self.opencv.forward(self.faces[0])
+        self.assertLess(np.sum((rep - reference)**2), TOLERANCE)
+
+if __name__ == '__main__':
+    unittest.main()
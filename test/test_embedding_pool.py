@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd.
+import os
+import unittest
+import numpy as np
+from ros_face_recognition import embedding
+from ros_face_recognition.embedding_pool import EmbeddingPool, BULK
+
+class MeanEmbedder(object):
+    """Mean intensity of each face, the worker exits on a white face"""
+
+    name = 'mean'
+
+    def __init__(self, network_model, img_dim=96):
+        pass
+
+    def forward_batch(self, faces):
+        faces = np.asarray(faces)
+        if (faces == 255).all():
+            os._exit(1)
+        means = faces.reshape(len(faces), -1).mean(axis=1)
+        return np.tile(means[:, None], (1, 128)).astype(np.float32)
+
+# The worker processes are forked and see the registered backend
+embedding.EMBEDDERS['mean'] = MeanEmbedder
+
+def faces(n, value):
+    return np.full((n, 96, 96, 3), value, dtype=np.uint8)
+
+class EmbeddingPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = EmbeddingPool('mean', None, workers=2, bulk_chunk=2)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_forward_batch(self):
+        reps = self.pool.forward_batch(faces(5, 7))
+        self.assertEqual(reps.shape, (5, 128))
+        self.assertTrue(np.allclose(reps, 7))
+
+    def test_bulk_keeps_order(self):
+        batch = np.concatenate([faces(1, v) for v in range(9)])
+        reps = self.pool.forward_batch(batch, BULK)
+        self.assertTrue(np.allclose(reps[:, 0], np.arange(9)))
+
+    def test_worker_restarts_after_dying(self):
+        self.pool.close()
+        self.pool = EmbeddingPool('mean', None, workers=1)
+        for _ in range(3):
+            with self.assertRaises(RuntimeError):
+                self.pool.forward_batch(faces(1, 255))
+            # The next request is served by the restarted worker
+            reps = self.pool.forward_batch(faces(2, 7))
+            self.assertTrue(np.allclose(reps, 7))
+        self.assertFalse(self.pool.closed)
+        self.assertEqual(self.pool.stats()['workers'], 1)
+
+    def test_close_fails_requests(self):
+        self.pool.forward_batch(faces(1, 7))
+        self.pool.close()
+        self.assertTrue(self.pool.closed)
+        with self.assertRaises(RuntimeError):
+            self.pool.forward_batch(faces(1, 7))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd.
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from ros_face_recognition.rep_store import RepStore, migrate_csv
+
+def reps(n, value, dim=128):
+    return np.full((n, dim), value, dtype=np.float32)
+
+class RepStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def torn_append(self, store, reps, labels):
+        """Write the rows of an append but fail before committing them"""
+        def fail():
+            raise IOError('torn')
+        store._commit = fail
+        self.assertRaises(IOError, store.append, reps, labels)
+
+    def test_torn_append(self):
+        store = RepStore(self.directory)
+        store.append(reps(2, 1), [('a', 'a1'), ('a', 'a2')])
+        self.torn_append(store, reps(1, 9), [('x', 'TORN')])
+
+        store = RepStore(self.directory)
+        self.assertEqual(store.count, 2)
+        store.append(reps(1, 2), [('b', 'b1')])
+
+        store = RepStore(self.directory)
+        self.assertEqual(list(store.labels()), ['a', 'a', 'b'])
+        self.assertEqual(store.names(), ['a1', 'a2', 'b1'])
+        self.assertEqual(list(store.reps()[:, 0]), [1, 1, 2])
+
+    def test_torn_append_without_log_size(self):
+        store = RepStore(self.directory)
+        store.append(reps(2, 1), [('a', 'a1'), ('a', 'a2')])
+        # A store written before the log size was recorded
+        with open(store.meta_fname) as f:
+            meta = json.load(f)
+        del meta['log_size']
+        with open(store.meta_fname, 'w') as f:
+            json.dump(meta, f)
+        self.torn_append(RepStore(self.directory), reps(1, 9), [('x', 'TORN')])
+
+        store = RepStore(self.directory)
+        store.append(reps(1, 2), [('b', 'b1')])
+        self.assertEqual(RepStore(self.directory).names(), ['a1', 'a2', 'b1'])
+
+    def test_migration_round_trip(self):
+        data = np.arange(3*4, dtype=np.float32).reshape(3, 4)/10
+        reps_fname = os.path.join(self.directory, 'reps.csv')
+        labels_fname = os.path.join(self.directory, 'labels.csv')
+        np.savetxt(reps_fname, data, delimiter=',')
+        with open(labels_fname, 'w') as f:
+            f.write('a,a1\nb,b1\na,a2\n')
+
+        store = RepStore(self.directory)
+        self.assertTrue(migrate_csv(store, reps_fname, labels_fname))
+        store = RepStore(self.directory, dim=4)
+        self.assertEqual(store.dim, 4)
+        np.testing.assert_allclose(store.reps(), data)
+        self.assertEqual(list(store.labels()), ['a', 'b', 'a'])
+        self.assertEqual(store.names(), ['a1', 'b1', 'a2'])
+        self.assertEqual(store.classes, ['a', 'b'])
+        # The store is newer than the csv files now
+        self.assertFalse(migrate_csv(store, reps_fname, labels_fname))
+
+        store.append(reps(1, 5, dim=4), [('c', 'c1')])
+        store = RepStore(self.directory)
+        self.assertEqual(list(store.labels()), ['a', 'b', 'a', 'c'])
+        self.assertEqual(store.names(), ['a1', 'b1', 'a2', 'c1'])
+
+if __name__ == '__main__':
+    unittest.main()